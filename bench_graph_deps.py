@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+"""
+bench_graph_deps measures how graph_deps performs, so changes to it can be
+compared run to run
+"""
+
+import argparse as ap
+import glob
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import time
+
+import graph_deps
+
+def _normalize(groups):
+    """reduces an import match to what was imported, so the output of the
+    different scanners can be compared
+    """
+    if groups[0]:
+        return ('import', groups[1])
+    return ('from', groups[3], groups[4].strip('(),'))
+
+def bench_parsers(root, parsers=('regex', 'ast')):
+    """times each python import scanner over every file under root, and
+    measures how well each one agrees with the ast scanner, which sees the
+    imports the same way the interpreter does
+
+    Arguments:
+        root (str): the root of the corpus to scan
+        parsers (tuple): the scanners to compare, from graph_deps.PY_SCANNERS
+
+    Returns:
+        results (dict): timings and accuracy of each scanner
+    """
+    files = glob.glob(os.path.join(root, "**/*.py"), recursive=True)
+    found = dict()
+    results = {'root': root, 'files': len(files), 'parsers': dict()}
+    for name in parsers:
+        scan = graph_deps.PY_SCANNERS[name]
+        found[name] = dict()
+        errors = 0
+        start = time.perf_counter()
+        for fl in files:
+            try:
+                found[name][fl] = {_normalize(groups) for groups in scan(fl)}
+            except (OSError, UnicodeDecodeError):
+                errors += 1
+        elapsed = time.perf_counter() - start
+        results['parsers'][name] = {
+            'seconds': elapsed,
+            'files_per_second': len(files) / elapsed if elapsed else None,
+            'imports': sum(len(imports) for imports in found[name].values()),
+            'errors': errors,
+        }
+
+    # the ast scanner is the reference for accuracy
+    if 'ast' in found:
+        truth = found['ast']
+        for name in parsers:
+            missed = extra = 0
+            for fl, imports in found[name].items():
+                if fl in truth:
+                    missed += len(truth[fl] - imports)
+                    extra += len(imports - truth[fl])
+            total = sum(len(imports) for imports in truth.values())
+            results['parsers'][name]['missed'] = missed
+            results['parsers'][name]['extra'] = extra
+            results['parsers'][name]['recall'] = (total - missed) / total if total else None
+    return results
+
+def bench_startup(runs=5, module='graph_deps'):
+    """measures how long it takes to import a module, with `python -X importtime`
+
+    Arguments:
+        runs (int): how many fresh interpreters to time, the fastest is kept
+        module (str): the module to import
+
+    Returns:
+        results (dict): the cumulative import time of the module, and of the
+        slowest modules it imports, in microseconds
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                cwd=here, capture_output=True, text=True, check=True)
+        # lines look like `import time:  self [us] | cumulative | imported package`
+        times = dict()
+        for line in proc.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            times[name.strip()] = max(times.get(name.strip(), 0), int(cumulative))
+        if best is None or times[module] < best[module]:
+            best = times
+    slowest = sorted(((name, us) for name, us in best.items() if name != module),
+            key=lambda item: -item[1])[:10]
+    return {'module': module, 'runs': runs, 'import_us': best[module], 'slowest': dict(slowest)}
+
+def _package_dirs(depth, branching=4):
+    """lists the package directories of a tree depth levels deep
+
+    Returns:
+        dirs (list): the directories, as tuples of their path parts
+    """
+    dirs = [()]
+    level = [()]
+    for d in range(depth):
+        level = [parent + (f'pkg{d}_{i}',) for parent in level for i in range(branching)]
+        dirs += level
+    return dirs
+
+def make_synthetic_tree(root, lang='py', files=1000, fanout=5, depth=3, cycle_density=0.01, seed=0):
+    """writes a synthetic project for graph_deps to analyze
+
+    File i only depends on files before it, except that each dependency
+    points forward instead with probability cycle_density, which closes
+    cycles.
+
+    Arguments:
+        root (str): the directory to write the project in
+        lang (str): 'py' or 'c++'
+        files (int): the number of files to write
+        fanout (int): the number of project files each file depends on
+        depth (int): how deeply packages are nested
+        cycle_density (float): the chance that a dependency makes a cycle
+        seed (int): the seed for the random choices
+    """
+    rng = random.Random(seed)
+    dirs = _package_dirs(depth)
+    ext = '.py' if lang == 'py' else '.h'
+    # spread the files over the packages
+    paths = [dirs[rng.randrange(len(dirs))] + (f'mod{i}{ext}',) for i in range(files)]
+    for parts in dirs:
+        os.makedirs(os.path.join(root, *parts), exist_ok=True)
+        if lang == 'py' and parts:
+            open(os.path.join(root, *parts, '__init__.py'), 'w').close()
+
+    for i, parts in enumerate(paths):
+        lines = []
+        for _ in range(min(fanout, files - 1)):
+            if rng.random() < cycle_density or i == 0:
+                j = rng.randrange(i + 1, files) if i + 1 < files else 0
+            else:
+                j = rng.randrange(i)
+            target = paths[j]
+            if lang == 'py':
+                module = '.'.join(target)[:-3]
+                if target[:-1] == parts[:-1]:
+                    lines.append(f'from . import {target[-1][:-3]}')
+                elif rng.random() < 0.5:
+                    lines.append(f'import {module}')
+                else:
+                    lines.append(f'from {module.rpartition(".")[0] or module} import {target[-1][:-3]}')
+            else:
+                lines.append(f'#include "{"/".join(target)}"')
+        # and something from outside the project
+        lines.append('import os' if lang == 'py' else '#include <vector>')
+        lines += ['', '# filler' if lang == 'py' else '// filler'] * 20
+        with open(os.path.join(root, *parts), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+def bench_synthetic(lang='py', sizes=(1000,), fanout=5, depth=3, cycle_density=0.01,
+        seed=0, jobs=1, engine='networkx', keep=None):
+    """times each phase of graph_deps on synthetic projects of each size
+
+    Arguments:
+        lang (str): 'py' or 'c++'
+        sizes (list): the file counts of the projects to generate
+        fanout (int): the number of project files each file depends on
+        depth (int): how deeply packages are nested
+        cycle_density (float): the chance that a dependency makes a cycle
+        seed (int): the seed for the random choices
+        jobs (int): the number of processes to scan with
+        engine (str): the graph engine to build
+        keep (str): a directory to keep the generated projects in
+
+    Returns:
+        results (dict): the configuration, then the phase timings of each size
+    """
+    results = {
+        'config': {'lang': lang, 'fanout': fanout, 'depth': depth, 'cycle_density': cycle_density,
+                'seed': seed, 'jobs': jobs, 'engine': engine},
+        'runs': [],
+    }
+    base = keep or tempfile.mkdtemp(prefix='bench_graph_deps_')
+    try:
+        for files in sizes:
+            root = os.path.join(base, f'{lang}_{files}')
+            if not os.path.exists(root):
+                make_synthetic_tree(root, lang, files, fanout, depth, cycle_density, seed)
+
+            profile = dict()
+            if lang == 'py':
+                graph = graph_deps.build_py_dependency_graph(root, jobs=jobs, engine=engine, profile=profile)
+            else:
+                graph = graph_deps.build_cxx_dependency_graph(root, jobs=jobs, include_dirs=[root],
+                        engine=engine, profile=profile)
+            stats = graph_deps.statistics(graph, verb=False, profile=profile)
+            with graph_deps._phase(profile, 'write'):
+                graph_deps.write_gv(stats['reduced'], os.path.join(base, 'dependencies.gv'))
+            timings = {name: phase['seconds'] for name, phase in profile['phases'].items()}
+
+            results['runs'].append({
+                'files': files,
+                'nodes': len(graph.nodes()),
+                'edges': graph.number_of_edges(),
+                'cyclic_components': len(stats['sccs']),
+                'seconds': timings,
+                'total_seconds': sum(timings.values()),
+                'peak_rss_kb': profile['phases']['write']['peak_rss_kb'],
+            })
+    finally:
+        if not keep:
+            shutil.rmtree(base)
+    return results
+
+if __name__ == "__main__":
+    parser = ap.ArgumentParser('bench_graph_deps', description="""bench_graph_deps
+            times the phases of graph_deps and writes the results as json""")
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    # the options every benchmark takes, after its name
+    common = ap.ArgumentParser(add_help=False)
+    common.add_argument('-o', '--out', action='store', dest='out', default=None,
+            type=str, help="where to write the json results, stdout by default")
+
+    parsers = sub.add_parser('parsers', parents=[common], help="compare the speed and accuracy of the python import scanners")
+    parsers.add_argument('root', action='store', nargs='?', type=str,
+            default=sysconfig.get_paths()['stdlib'],
+            help='the root of the corpus to scan, the standard library by default')
+
+    startup = sub.add_parser('startup', parents=[common], help="time how long graph_deps takes to import")
+    startup.add_argument('-n', '--runs', action='store', dest='runs', default=5,
+            type=int, help="the number of interpreters to time, the fastest is kept")
+    startup.add_argument('--budget', action='store', dest='budget', default=None,
+            type=float, help="fail if importing takes longer than this many milliseconds")
+
+    synthetic = sub.add_parser('synthetic', parents=[common], help="time each phase of graph_deps on generated projects")
+    synthetic.add_argument('-l', '--lang', action='store', dest='lang', default='py',
+            choices=('py', 'c++'), help="the language of the projects to generate")
+    synthetic.add_argument('-n', '--files', action='store', dest='files', nargs='+', default=[1000, 10000],
+            type=int, help="the file counts of the projects to generate")
+    synthetic.add_argument('--fanout', action='store', dest='fanout', default=5,
+            type=int, help="the number of project files each file depends on")
+    synthetic.add_argument('--depth', action='store', dest='depth', default=3,
+            type=int, help="how deeply packages are nested")
+    synthetic.add_argument('--cycle-density', action='store', dest='cycle_density', default=0.01,
+            type=float, help="the chance that a dependency makes a cycle")
+    synthetic.add_argument('--seed', action='store', dest='seed', default=0,
+            type=int, help="the seed for generating projects")
+    synthetic.add_argument('-j', '--jobs', action='store', dest='jobs', default=1,
+            type=int, help="the number of processes to scan files with")
+    synthetic.add_argument('-e', '--engine', action='store', dest='engine', default='networkx',
+            choices=tuple(graph_deps.GRAPH_ENGINES), help="the graph engine to benchmark")
+    synthetic.add_argument('--keep', action='store', dest='keep', default=None,
+            type=str, help="a directory to keep the generated projects in, and reuse them from")
+
+    args = parser.parse_args()
+
+    if args.bench == 'parsers':
+        results = bench_parsers(args.root)
+    elif args.bench == 'startup':
+        results = bench_startup(args.runs)
+    elif args.bench == 'synthetic':
+        results = bench_synthetic(args.lang, args.files, args.fanout, args.depth, args.cycle_density,
+                args.seed, args.jobs, args.engine, args.keep)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.out}")
+    else:
+        print(json.dumps(results, indent=2))
+
+    # let ci catch startup regressions
+    if args.bench == 'startup' and args.budget is not None and results['import_us'] > args.budget * 1000:
+        print(f"Import took {results['import_us'] / 1000:.1f}ms, over the {args.budget}ms budget")
+        sys.exit(1)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+"""
+bench_roll measures how fast roll rolls dice, and checks that the faster ways
+of rolling them still roll fair dice
+"""
+
+import argparse as ap
+import importlib.util
+import json
+import math
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+import roll
+
+# the kinds of roll to measure: plain, advantage and disadvantage
+KEEPS = (None, 'a', 'd')
+
+def available_engines():
+    """lists the ways roll can roll dice here: each engine of do_rolls whose
+    module is installed, then the streaming summarize_rolls on each of them
+
+    Returns:
+        engines (list): the engine names, summaries being 'summary-<engine>'
+    """
+    engines = [engine for engine in roll.ENGINES if engine == 'python' or importlib.util.find_spec(engine)]
+    return engines + [f'summary-{engine}' for engine in engines]
+
+def _roll(engine, x, y, keep, rng):
+    """rolls x, y-sided dice once, the way roll does with the engine
+
+    Returns:
+        result: the dice rolled, or their Summary
+        total (int): the total of the dice
+    """
+    if engine.startswith('summary-'):
+        return roll.summarize_rolls([(x, y, keep)], engine[len('summary-'):], rng)[0][0]
+    return roll.do_rolls([(x, y, keep)], engine, rng)[0][0]
+
+def _pmf(y, keep):
+    """gives the chance of each face of a roll, from 1 to y"""
+    if keep == 'a':
+        return [(2 * k - 1) / (y * y) for k in range(1, y + 1)]
+    if keep == 'd':
+        return [(2 * (y - k) + 1) / (y * y) for k in range(1, y + 1)]
+    return [1 / y] * y
+
+def _chi2_sf(x, df):
+    """gives the chance of a chi-square statistic of at least x with df
+    degrees of freedom, by the Wilson-Hilferty approximation, which is close
+    enough to tell a fair die from a biased one
+    """
+    if df <= 0:
+        return 1.0
+    z = ((x / df) ** (1 / 3) - (1 - 2 / (9 * df))) / math.sqrt(2 / (9 * df))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+def bench_speed(counts=(1, 100, 10**4, 10**6, 10**8), sides=(6, 20, 100), keeps=KEEPS,
+        engines=None, repeat=3, python_max=10**6, seed=0):
+    """times each engine rolling each number of dice with each number of
+    sides, plain and with advantage and disadvantage, and measures the most
+    memory each roll takes
+
+    Arguments:
+        counts (list): the numbers of dice to roll
+        sides (list): the numbers of sides of the dice
+        keeps (list): the kinds of roll, None, 'a' or 'd'
+        engines (list): the engines to time, all the available ones by default
+        repeat (int): the most times to time each roll, the fastest is kept.
+            Rolls stop being repeated after a second.
+        python_max (int): the most dice to roll in pure python, which is
+            too slow for the biggest rolls
+        seed (int): the seed to roll with
+
+    Returns:
+        results (dict): the configuration, then the dice per second and peak
+        memory of each roll
+    """
+    engines = engines or available_engines()
+    results = {
+        'config': {'counts': list(counts), 'sides': list(sides), 'keeps': list(keeps),
+                'engines': engines, 'repeat': repeat, 'python_max': python_max, 'seed': seed},
+        'runs': [],
+    }
+    for engine in engines:
+        base = engine.rpartition('-')[2]
+        rng = roll.make_rng(base, seed)
+        for y in sides:
+            for keep in keeps:
+                for x in counts:
+                    run = {'engine': engine, 'dice': x, 'sides': y, 'keep': keep}
+                    results['runs'].append(run)
+                    if base == 'python' and x > python_max:
+                        run['skipped'] = True
+                        continue
+
+                    best = None
+                    spent = 0
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        _roll(engine, x, y, keep, rng)
+                        elapsed = time.perf_counter() - start
+                        best = elapsed if best is None else min(best, elapsed)
+                        spent += elapsed
+                        if spent > 1:
+                            break
+
+                    # measured apart from the timing, which tracing slows
+                    tracemalloc.start()
+                    _roll(engine, x, y, keep, rng)
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+
+                    run.update({
+                        'seconds': best,
+                        'dice_per_second': x / best if best else None,
+                        'peak_bytes': peak,
+                    })
+    return results
+
+def bench_uniformity(dice=10**6, sides=(2, 6, 20, 100), keeps=KEEPS, engines=None, seed=0, alpha=0.001):
+    """rolls a lot of dice with each engine and checks, by a chi-square test,
+    that the faces come up as often as they should
+
+    Arguments:
+        dice (int): the number of dice to roll for each test
+        sides (list): the numbers of sides of the dice
+        keeps (list): the kinds of roll, None, 'a' or 'd'
+        engines (list): the engines to test, all the available ones by default
+        seed (int): the seed to roll with
+        alpha (float): the p-value under which a test fails
+
+    Returns:
+        results (dict): the configuration, then the chi-square statistic,
+        p-value and verdict of each test
+    """
+    engines = engines or available_engines()
+    results = {
+        'config': {'dice': dice, 'sides': list(sides), 'keeps': list(keeps),
+                'engines': engines, 'seed': seed, 'alpha': alpha},
+        'tests': [],
+    }
+    for engine in engines:
+        rng = roll.make_rng(engine.rpartition('-')[2], seed)
+        for y in sides:
+            for keep in keeps:
+                result, _ = _roll(engine, dice, y, keep, rng)
+                if isinstance(result, roll.Summary):
+                    width, observed = result.width, result.hist
+                else:
+                    counts = Counter(result.tolist() if hasattr(result, 'tolist') else result)
+                    width, observed = 1, [counts[face] for face in range(1, y + 1)]
+                pmf = _pmf(y, keep)
+                expected = [dice * sum(pmf[i * width:(i + 1) * width]) for i in range(len(observed))]
+                chi2 = sum((o - e) ** 2 / e for o, e in zip(observed, expected) if e)
+                df = sum(1 for e in expected if e) - 1
+                p = _chi2_sf(chi2, df)
+                results['tests'].append({
+                    'engine': engine, 'sides': y, 'keep': keep, 'bins': len(observed),
+                    'chi2': chi2, 'df': df, 'p_value': p, 'passed': p >= alpha,
+                })
+    return results
+
+if __name__ == "__main__":
+    parser = ap.ArgumentParser('bench_roll', description="""bench_roll times
+            the engines of roll, checks that their dice are fair, and writes the
+            results as json""")
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    # the options every benchmark takes, after its name
+    common = ap.ArgumentParser(add_help=False)
+    common.add_argument('-e', '--engine', action='append', dest='engines', default=None,
+            choices=available_engines(), help="an engine to benchmark, may be given more than once, all by default")
+    common.add_argument('--seed', action='store', dest='seed', default=0,
+            type=int, help="the seed to roll with")
+    common.add_argument('-o', '--out', action='store', dest='out', default=None,
+            type=str, help="where to write the json results, stdout by default")
+
+    speed = sub.add_parser('speed', parents=[common], help="time each engine over numbers of dice and sides")
+    speed.add_argument('-n', '--dice', action='store', dest='counts', nargs='+',
+            default=[1, 100, 10**4, 10**6, 10**8], type=int, help="the numbers of dice to roll")
+    speed.add_argument('-s', '--sides', action='store', dest='sides', nargs='+', default=[6, 20, 100],
+            type=int, help="the numbers of sides of the dice")
+    speed.add_argument('-r', '--repeat', action='store', dest='repeat', default=3,
+            type=int, help="the most times to time each roll, the fastest is kept")
+    speed.add_argument('--python-max', action='store', dest='python_max', default=10**6,
+            type=int, help="the most dice to roll in pure python")
+
+    uniformity = sub.add_parser('uniformity', parents=[common], help="check that each engine rolls fair dice")
+    uniformity.add_argument('-n', '--dice', action='store', dest='dice', default=10**6,
+            type=int, help="the number of dice to roll for each test")
+    uniformity.add_argument('-s', '--sides', action='store', dest='sides', nargs='+', default=[2, 6, 20, 100],
+            type=int, help="the numbers of sides of the dice")
+    uniformity.add_argument('--alpha', action='store', dest='alpha', default=0.001,
+            type=float, help="fail a test with a p-value under this")
+
+    args = parser.parse_args()
+
+    if args.bench == 'speed':
+        results = bench_speed(args.counts, args.sides, KEEPS, args.engines, args.repeat, args.python_max, args.seed)
+    elif args.bench == 'uniformity':
+        results = bench_uniformity(args.dice, args.sides, KEEPS, args.engines, args.seed, args.alpha)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.out}")
+    else:
+        print(json.dumps(results, indent=2))
+
+    # let ci catch engines that roll unfair dice
+    if args.bench == 'uniformity':
+        failed = [test for test in results['tests'] if not test['passed']]
+        for test in failed:
+            print(f"{test['engine']} d{test['sides']}{test['keep'] or ''} looks biased, p = {test['p_value']:.2g}")
+        if failed:
+            sys.exit(1)
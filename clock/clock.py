@@ -6,15 +6,17 @@
 
 import copy
 import datetime
+import hashlib
 import json
 import os
 import sys
 import time
 import platform
+import sqlite3
 from math import ceil, floor
 from os import path
 
-COMMANDS = ('in', 'out', 'help', 'total', 't', 'clear', 'c', 'show', 's', 'list', 'ls', 'rename', 'r')
+COMMANDS = ('in', 'out', 'help', 'total', 't', 'clear', 'c', 'show', 's', 'list', 'ls', 'rename', 'r', 'migrate')
 MESSAGEABLE_COMMANDS = ('in', 'out', 'rename', 'r')
 CARD_MAX = 10
 
@@ -25,6 +27,15 @@ else:
 
 CLOCK_LOCATION = root + os.getenv('USER') +'/.clock_data'
 CLOCK_LOCATION_OLD = root + os.getenv('USER') + '/.clock_data.old'
+CLOCK_JOURNAL = root + os.getenv('USER') + '/.clock_data.journal'
+CLOCK_DB = root + os.getenv('USER') + '/.clock_db'
+
+# fold the journal into the clock file once it holds this many punches
+JOURNAL_MAX = 256
+
+# which clock file the loaded journal follows on from, and how many punches
+# it holds, kept by get_card_json for record
+journal = {"base": None, "current": False, "events": 0}
 
 #################
 ### Structure ###
@@ -55,6 +66,23 @@ CLOCK_LOCATION_OLD = root + os.getenv('USER') + '/.clock_data.old'
 #     etc...
 # }
 
+###############
+### Journal ###
+###############
+# The clock file is only rewritten now and then. In between, each change is
+# appended to the journal as a line of json, so a punch writes one line
+# however long the history gets:
+#
+# {"base": "<sha1 of the clock file this journal follows on from>"}
+# {"op": "in", "card": "1", "time": 1565556903}
+# {"op": "out", "card": "1", "time": 1565557532, "msg": "reviews"}
+# {"op": "rename", "card": "1", "to": "reviews"}
+# {"op": "clear", "card": "0"}
+#
+# Loading replays the journal over the clock file. A journal whose base isn't
+# the clock file is left over from a rewrite that was cut short, and is
+# already in the clock file.
+
 def parseArgs():
     """
     Parses and verifies command line arguments
@@ -64,7 +92,7 @@ def parseArgs():
       (str): the command to execute
       (str): the number of the card to work on, or "0" if not provided
       (str): the message associated with this punch
-      (dict): the punch data
+      (JsonStore or SqliteStore): the store holding the cards
     """
     args = sys.argv
 
@@ -90,22 +118,23 @@ def parseArgs():
     if args[1] not in COMMANDS:
         raise ValueError(f"Unknown command: '{args[1]}'")
 
-    # get the cards json
-    cards = get_card_json()
+    # open the cards
+    store = open_store()
 
     # if no card was provided:
     if len(args) < 3:
-        return args[1], "0", msg, cards
+        return args[1], "0", msg, store
 
     # validate the card name
-    if len(cards.keys()) >= CARD_MAX and not args[2] in cards.keys():
+    names = store.names()
+    if len(names) >= CARD_MAX and not args[2] in names:
         raise ValueError("Max number of cards exceeded")
 
-    if args[1] != "in" and not args[2] in cards.keys():
+    if args[1] != "in" and not args[2] in names:
         raise ValueError("Card does not exist")
 
     # return the card number as a string
-    return args[1], args[2], msg, cards
+    return args[1], args[2], msg, store
 
 def usage():
     """
@@ -121,6 +150,8 @@ def usage():
     print(" list    lists the existing cards")
     print(" total   totals the time for the specified card")
     print(" clear   clears punches for the specified card")
+    print(" migrate moves the cards into a sqlite database, which is quicker")
+    print("         for long histories and is used from then on")
     print(" help    displays this message")
     print("")
     print("Available flags are:")
@@ -136,38 +167,350 @@ def usage():
     print(" or clearing the clock, confirmation is always requested. Then in/out")
     print(" punches will overwrite the previous saved in/out punch")
     print("")
-    print(f"Timecard data is saved at {CLOCK_LOCATION}")
+    print(f"Timecard data is saved at {CLOCK_LOCATION}, and each punch is")
+    print(f" journaled at {CLOCK_JOURNAL} until it is folded in, or at")
+    print(f" {CLOCK_DB} once migrated. Set CLOCK_STORE to json or sqlite to")
+    print(" choose between them")
     print("")
     print("Created by Eric Steadman, Copyright 2019")
     print("Report bugs to es3649@gmail.com")
 
 def get_card_json():
     """
-    Gets the clock object from the data in the clock file
+    Gets the clock object from the data in the clock file, then replays the
+    punches journaled since it was written
 
     Return:
       a dictionary representing the deserialized json
     """
     try:
+        data = b""
+        cards = dict()
         # check that the file exists
-        if not path.exists(CLOCK_LOCATION):
-            return dict()
-        else:
-            with open(CLOCK_LOCATION, 'r') as f:
-                return json.load(f)
+        if path.exists(CLOCK_LOCATION):
+            with open(CLOCK_LOCATION, 'rb') as f:
+                data = f.read()
+            cards = json.loads(data)
+        journal["base"] = hashlib.sha1(data).hexdigest()
+        journal["current"] = False
+        journal["events"] = 0
+
+        if path.exists(CLOCK_JOURNAL):
+            with open(CLOCK_JOURNAL, 'rb') as f:
+                lines = f.read().splitlines()
+            if lines and json.loads(lines[0]).get("base") == journal["base"]:
+                journal["current"] = True
+                for line in lines[1:]:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # the last punch was cut off, so rewrite the clock
+                        # file before appending after it
+                        journal["current"] = False
+                        break
+                    apply_event(cards, event)
+                    journal["events"] += 1
+        return cards
     except Exception as e:
         print(f'Failed to load json with error {str(e)}')
         raise e
 
 def save_card_json(obj):
     """
-    Takes an object to serialize and saves it to the clock file
+    Takes an object to serialize and saves it to the clock file, then starts
+    a new journal after it. The files are replaced whole, so a crash leaves
+    either the old ones or the new ones.
 
     Arguments:
       obj (obj): the object to serialize and store.
     """
-    with open(CLOCK_LOCATION, 'w+') as f:
-        json.dump(obj, f, indent="  ")
+    data = json.dumps(obj, indent="  ").encode()
+    for location, contents in ((CLOCK_LOCATION, data),
+            (CLOCK_JOURNAL, json.dumps({"base": hashlib.sha1(data).hexdigest()}).encode() + b"\n")):
+        with open(location + '.tmp', 'wb') as f:
+            f.write(contents)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(location + '.tmp', location)
+    journal["base"] = hashlib.sha1(data).hexdigest()
+    journal["current"] = True
+    journal["events"] = 0
+
+def apply_event(full_card, event):
+    """
+    Applies a journaled change to the cards, the same way when punching as
+    when replaying the journal
+
+    Arguments:
+      full_card (dict): a dictionary containing the timecard data
+      event (dict): the change, see Journal above
+    """
+    op, card_num = event["op"], event["card"]
+    if op == "in":
+        card = full_card.setdefault(card_num, {"cur": dict(), "punches": list()})
+        if "out" in card["cur"]:
+            # be sure to append a copy, because reference variables
+            card["punches"].append(copy.deepcopy(card["cur"]))
+            del card["cur"]["out"]
+            # clear the message if present
+            card["cur"].pop("msg", None)
+        card["cur"]["in"] = event["time"]
+    elif op == "out":
+        card = full_card[card_num]
+        card["cur"]["out"] = event["time"]
+    elif op == "rename":
+        full_card[event["to"]] = full_card.pop(card_num)
+    elif op == "clear":
+        if card_num == "0":
+            full_card.clear()
+        else:
+            del full_card[card_num]
+
+    # add the message
+    if "msg" in event:
+        full_card[card_num]["cur"]["msg"] = event["msg"]
+
+def record(full_card, event):
+    """
+    Applies a change to the cards and saves it, by appending it to the
+    journal, or by rewriting the clock file once the journal is full
+
+    Arguments:
+      full_card (dict): a dictionary containing the timecard data
+      event (dict): the change, see Journal above
+    """
+    apply_event(full_card, event)
+    if not journal["current"] or journal["events"] >= JOURNAL_MAX:
+        save_card_json(full_card)
+        return
+    with open(CLOCK_JOURNAL, 'ab') as f:
+        f.write(json.dumps(event).encode() + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+    journal["events"] += 1
+
+class JsonStore:
+    """
+    Keeps the cards in the clock file and its journal, loading all of them
+    on every run
+    """
+    def __init__(self):
+        self.cards = get_card_json()
+
+    def names(self):
+        """lists the names of the cards"""
+        return list(self.cards)
+
+    def current(self, name):
+        """gives the current punch of a card, None if there is no such card"""
+        card = self.cards.get(name)
+        return None if card is None else card["cur"]
+
+    def card(self, name):
+        """gives a card as it is laid out in Structure, None if there is no such card"""
+        return self.cards.get(name)
+
+    def subtotal(self, name, now):
+        """
+        adds up the seconds on a card, counting up to now if it is punched in
+
+        Return:
+          (int): the number of seconds on the card
+          (bool): is the clock currently punched in?
+        or None if there is no such card
+        """
+        card = self.cards.get(name)
+        if card is None:
+            return None
+        cur = card["cur"]
+        punches = card["punches"] + ([cur] if "in" in cur else [])
+        return sum(punch.get("out", now) - punch["in"] for punch in punches), "in" in cur and "out" not in cur
+
+    def record(self, event):
+        """applies a change, see Journal above, and saves it"""
+        record(self.cards, event)
+
+class SqliteStore:
+    """
+    Keeps the cards in a sqlite database, so each command only reads and
+    writes the rows it needs. Every punch of a card, the current one too,
+    is a row of punches, and the card points at its current punch.
+    """
+    SCHEMA = """
+        PRAGMA journal_mode = WAL;
+        CREATE TABLE IF NOT EXISTS cards (
+            id INTEGER PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL,
+            cur INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS punches (
+            id INTEGER PRIMARY KEY,
+            card INTEGER NOT NULL REFERENCES cards (id),
+            in_time INTEGER NOT NULL,
+            out_time INTEGER,
+            msg TEXT
+        );
+        CREATE INDEX IF NOT EXISTS punches_by_card ON punches (card, in_time);
+    """
+
+    def __init__(self, location=CLOCK_DB, create=False):
+        """
+        Opens the database, which only migrate creates, so that using the
+        store before migrating doesn't leave an empty database to be used
+        instead of the clock file
+        """
+        if create:
+            self.db = sqlite3.connect(location)
+            self.db.executescript(self.SCHEMA)
+            return
+        try:
+            self.db = sqlite3.connect(f"file:{location}?mode=rw", uri=True)
+        except sqlite3.OperationalError:
+            raise ValueError(f"There is no database at {location}, run `clock migrate` to make one")
+
+    @staticmethod
+    def _punch(in_time, out_time, msg):
+        """lays out a row of punches as it is in Structure"""
+        punch = {"in": in_time}
+        if out_time is not None:
+            punch["out"] = out_time
+        if msg is not None:
+            punch["msg"] = msg
+        return punch
+
+    def _card(self, name):
+        """gives the id and current punch id of a card, None if there is no such card"""
+        return self.db.execute("SELECT id, cur FROM cards WHERE name = ?", (name,)).fetchone()
+
+    def names(self):
+        """lists the names of the cards"""
+        return [name for name, in self.db.execute("SELECT name FROM cards ORDER BY id")]
+
+    def current(self, name):
+        """gives the current punch of a card, None if there is no such card"""
+        card = self._card(name)
+        if card is None:
+            return None
+        row = self.db.execute("SELECT in_time, out_time, msg FROM punches WHERE id = ?", (card[1],)).fetchone()
+        return dict() if row is None else self._punch(*row)
+
+    def card(self, name):
+        """gives a card as it is laid out in Structure, None if there is no such card"""
+        card = self._card(name)
+        if card is None:
+            return None
+        full = {"cur": dict(), "punches": list()}
+        for punch_id, *row in self.db.execute("""SELECT id, in_time, out_time, msg FROM punches
+                WHERE card = ? ORDER BY in_time, id""", (card[0],)):
+            if punch_id == card[1]:
+                full["cur"] = self._punch(*row)
+            else:
+                full["punches"].append(self._punch(*row))
+        return full
+
+    def subtotal(self, name, now):
+        """
+        adds up the seconds on a card, counting up to now if it is punched in
+
+        Return:
+          (int): the number of seconds on the card
+          (bool): is the clock currently punched in?
+        or None if there is no such card
+        """
+        card = self._card(name)
+        if card is None:
+            return None
+        seconds, = self.db.execute("""SELECT coalesce(sum(coalesce(out_time, ?) - in_time), 0)
+                FROM punches WHERE card = ?""", (now, card[0])).fetchone()
+        punched_in = self.db.execute("SELECT 1 FROM punches WHERE id = ? AND out_time IS NULL",
+                (card[1],)).fetchone()
+        return seconds, punched_in is not None
+
+    def _delete(self, card_id):
+        """deletes a card and its punches"""
+        self.db.execute("DELETE FROM punches WHERE card = ?", (card_id,))
+        self.db.execute("DELETE FROM cards WHERE id = ?", (card_id,))
+
+    def record(self, event):
+        """applies a change, see Journal above, and saves it"""
+        op, name, msg = event["op"], event["card"], event.get("msg")
+        with self.db:
+            card = self._card(name)
+            if op == "in":
+                if card is None:
+                    card = (self.db.execute("INSERT INTO cards (name) VALUES (?)", (name,)).lastrowid, None)
+                if self.db.execute("SELECT 1 FROM punches WHERE id = ? AND out_time IS NULL",
+                        (card[1],)).fetchone():
+                    self.db.execute("UPDATE punches SET in_time = ?, msg = coalesce(?, msg) WHERE id = ?",
+                            (event["time"], msg, card[1]))
+                else:
+                    cur = self.db.execute("INSERT INTO punches (card, in_time, msg) VALUES (?, ?, ?)",
+                            (card[0], event["time"], msg)).lastrowid
+                    self.db.execute("UPDATE cards SET cur = ? WHERE id = ?", (cur, card[0]))
+            elif op == "out":
+                self.db.execute("UPDATE punches SET out_time = ?, msg = coalesce(?, msg) WHERE id = ?",
+                        (event["time"], msg, card[1]))
+            elif op == "rename":
+                other = self._card(event["to"])
+                if other is not None and other != card:
+                    self._delete(other[0])
+                self.db.execute("UPDATE cards SET name = ? WHERE id = ?", (event["to"], card[0]))
+            elif op == "clear":
+                if name == "0":
+                    self.db.execute("DELETE FROM punches")
+                    self.db.execute("DELETE FROM cards")
+                else:
+                    self._delete(card[0])
+
+# the ways cards can be kept, CLOCK_STORE picks one, otherwise sqlite is used
+# once there is a database
+STORES = {"json": JsonStore, "sqlite": SqliteStore}
+
+def open_store():
+    """
+    Opens the store the cards are kept in
+
+    Return:
+      (JsonStore or SqliteStore): the store
+    """
+    name = os.getenv("CLOCK_STORE") or ("sqlite" if path.exists(CLOCK_DB) else "json")
+    if name not in STORES:
+        raise ValueError(f"Unknown store: '{name}', expected one of {', '.join(STORES)}")
+    return STORES[name]()
+
+def migrate(store):
+    """
+    Copies the cards from the clock file and its journal into a new sqlite
+    database, which is used from then on. The clock file is left as it was.
+
+    Arguments:
+      store (JsonStore): the cards to copy
+    """
+    if not isinstance(store, JsonStore) or path.exists(CLOCK_DB):
+        print(f"Cards are already kept in {CLOCK_DB}")
+        return
+
+    # build the database aside, so it is only used once it is complete
+    temp = CLOCK_DB + '.tmp'
+    if path.exists(temp):
+        os.remove(temp)
+    db = SqliteStore(temp, create=True).db
+    punches = 0
+    with db:
+        for name, card in store.cards.items():
+            card_id = db.execute("INSERT INTO cards (name) VALUES (?)", (name,)).lastrowid
+            db.executemany("INSERT INTO punches (card, in_time, out_time, msg) VALUES (?, ?, ?, ?)",
+                    ((card_id, punch["in"], punch.get("out"), punch.get("msg")) for punch in card["punches"]))
+            punches += len(card["punches"])
+            cur = card["cur"]
+            if "in" in cur:
+                cur_id = db.execute("INSERT INTO punches (card, in_time, out_time, msg) VALUES (?, ?, ?, ?)",
+                        (card_id, cur["in"], cur.get("out"), cur.get("msg"))).lastrowid
+                db.execute("UPDATE cards SET cur = ? WHERE id = ?", (cur_id, card_id))
+                punches += 1
+    db.close()
+    os.replace(temp, CLOCK_DB)
+    print(f"Copied {len(store.cards)} cards and {punches} punches into {CLOCK_DB}")
 
     
 def confirm(prompt, message=""):
@@ -195,7 +538,28 @@ def make_time(epoch_seconds):
 def make_time_hms(seconds):
     return f"{seconds//3600}:{seconds%3600//60:02}"
 
-def punch_in(full_card, card_num, msg):
+def record_punch(store, op, card_num, msg):
+    """
+    Punches in or out on a card with the current time, and saves the punch
+
+    Arguments:
+      store (JsonStore or SqliteStore): the store holding the cards
+      op (str): "in" or "out"
+      card_num (str): the number of the card to punch
+      msg (str): the message of the punch, or 0 for none
+
+    Return:
+      (int): the time of the punch
+    """
+    now = int(time.time())
+    event = {"op": op, "card": card_num, "time": now}
+    # add the message
+    if msg != 0:
+        event["msg"] = msg
+    store.record(event)
+    return now
+
+def punch_in(store, card_num, msg):
     """
     Punches in with the current time.
     If the last punch was an in punch, then request confirmation,
@@ -204,124 +568,79 @@ def punch_in(full_card, card_num, msg):
     Arguments:
       card_number (str): String containing the number of the card to punch in on. Shall be >0
     """
-    # get the card from the conglomerate
-    if card_num in full_card:
-        card = full_card[card_num]
-    else:
-        # initialize a new card
-        card = dict()
-        full_card[card_num] = card
-        card["cur"] = dict()
-        card["punches"] = list()
+    # get the card from the conglomerate, the punch initializes a new card
+    cur_punch = store.current(card_num)
+    if cur_punch is None:
+        cur_punch = dict()
         print(f"Creating card {card_num}...")
 
-    # grap the current punch
-    cur_punch = card["cur"]
-    # print(card)
-
     if "out" in cur_punch or "in" not in cur_punch:
-        if "out" in cur_punch:
-            # be sure to append a copy, because reference variables
-            save = copy.deepcopy(cur_punch)
-            card["punches"].append(save)
-            del card["cur"]["out"]
-            # clear the message if present
-            if "msg" in card["cur"]:
-                del card["cur"]["msg"]
-        now = int(time.time())
-        card["cur"]["in"] = now
-        # add the message
-        if msg != 0:
-            card["cur"]["msg"] = msg
-
-        save_card_json(full_card)
+        now = record_punch(store, "in", card_num, msg)
         print(f'Punched in at: {make_time(now)}')
     else:
         if not confirm("Overwrite it?", "An 'in' punch already exists."):
             return 
         # else:
-        now = int(time.time())
-        card["cur"]["in"] = now
-        # add the message
-        if msg != 0:
-            card["cur"]["msg"] = msg
+        now = record_punch(store, "in", card_num, msg)
         print(f'Punch overridden, now in at: {make_time(now)}')
         return
 
 
-def punch_out(full_card, card_num, msg):
+def punch_out(store, card_num, msg):
     """
     Punches out with the current time.
     If the last punch was an out punch, then request confirmation,
     then (if affirmative) replace the old out punch with the current time
 
     Arguments:
-      full_card (dict): a dictionary containing the timecard data
+      store (JsonStore or SqliteStore): the store holding the cards
       card_num (str): String containing the number of the card to punch out on. Shall be >0
     """
     # get the card data
-    if card_num in full_card:
-        card = full_card[card_num]
-    else:
-        # initialize a new card
-        card = dict()
-        full_card[card_num]
-        card["cur"] = dict()
-        card["punches"] = list()
+    cur_punch = store.current(card_num)
+    if cur_punch is None:
         print(f"Card number {card_num} is not initialized")
-        print("Initializing and not adding an out punch")
+        print("Not adding an out punch")
         return
 
-    cur_punch = card["cur"]
-
     if "out" in cur_punch or "in" not in cur_punch:
         # if there is already an out punch
         if "out" in cur_punch:
             if not confirm("Overwrite it?", "An 'out' punch already exists."):
                 return 
             # else:
-            now = int(time.time())
-            card["cur"]["out"] = now
-            # add the message
-            if msg != 0:
-                card["cur"]["msg"] = msg
-            save_card_json(full_card)
+            now = record_punch(store, "out", card_num, msg)
             print(f'Punch overridden, now out at: {make_time(now)}')
 
-        elif "in" not in cur_punch and len(card["punches"]) == 0:
+        elif "in" not in cur_punch:
             # if there are no punches (at all), we can't do anything
             print("Card has no punches (not even an in punch!)")
             print("Not adding an out punch")
             return
 
     else:
-        now = int(time.time())
-        card["cur"]["out"] = now
-        # add the message
-        if msg != 0:
-            card["cur"]["msg"] = msg
-        save_card_json(full_card)
+        now = record_punch(store, "out", card_num, msg)
         print(f'Punched out at {make_time(now)}')
 
 
-def list_cards(full_card):
+def list_cards(store):
     """
     Lists the names of the cards on record
     Now that cards can have names, it will be useful to know which ones there are
 
     Arguments:
-      full_card (dict): a dictionary containing the timecard data
+      store (JsonStore or SqliteStore): the store holding the cards
     """
     print("The following cards are available:")
-    for key in full_card.keys():
+    for key in store.names():
         print(f"  {key}")
 
-def rename(full_card, name, new_name):
+def rename(store, name, new_name):
     """
     rename will change the name of a card
 
     Arguments:
-      full_card (dict): a dictionary containing the timecard data
+      store (JsonStore or SqliteStore): the store holding the cards
       name (str): the name of the card to rename
       new_name (str): the new name of the card
     """
@@ -329,81 +648,61 @@ def rename(full_card, name, new_name):
     # this will only move the card if either
     #   1. there was no card with the new name
     #   2. they confirmed the overwrite
-    if not new_name in full_card or confirm("Would you like to overwrite it?", f"A card named {new_name} already exists"):
+    names = store.names()
+    if not new_name in names or confirm("Would you like to overwrite it?", f"A card named {new_name} already exists"):
         # if we are overwriting, then overwrite
-        if new_name in full_card:
+        if new_name in names:
             print("Overwriting...")
         # if just moveing, then move
         else:
             print("Renaming card...")
         # do the move, delete the old card
-        full_card[new_name] = full_card[name]
-        del full_card[name]
+        store.record({"op": "rename", "card": name, "to": new_name})
         print(f"Card has been renamed {new_name}")
-        save_card_json(full_card)
         return
     # this will only run if they denied an overwrite
     print("Skipping rename...")
 
 
-def subtotal(full_card, number):
+def subtotal(store, number):
     """
     Totals a single card (0 is invalid input)
     adds up the number of seconds on the record, and returns it
 
     Arguments:
-      full_card (dict): the timecard object to total
+      store (JsonStore or SqliteStore): the store holding the cards
       number (int): the number of the card to total
 
     Return:
       (int): the number of seconds on the card
       (bool): is the clock currently punched in?
     """
+    time_sum = store.subtotal(number, int(time.time()))
     # ensure the card exists
-    if number not in full_card:
+    if time_sum is None:
         print(f"Card {number} does not exist")
         return -1
+    return time_sum
 
-    # get the card
-    card = full_card[number]
-    time_sum = 0
-    if "in" in card["cur"]:
-        punched_in = True
-
-
-    # add the current punch
-    if "out" in card["cur"]:
-        time_sum += card["cur"]["out"]-card["cur"]["in"]
-        punched_in = False
-    else:
-        time_sum += int(time.time())-card["cur"]["in"]
-
-    # add each punch we've logged
-    for punch in card["punches"]:
-        time_sum += punch["out"]-punch["in"]
-
-    return time_sum, punched_in
-
-def total(card_full, name="0"):
+def total(store, name="0"):
     """
     Totals the time on the given card(s) and prints it
     This is a sub function of the show command.
 
     Arguments:
-      card_full (dict): the card json data
+      store (JsonStore or SqliteStore): the store holding the cards
       number (str): the number of the card to total, "0" to show all cards
     """
     if name == "0":
-        for key in card_full.keys():
-            if key in card_full:
-                sbt, is_in = subtotal(card_full,key)
-                if is_in:
-                    msg = " and clocked in"
-                else:
-                    msg = ""
-                print(f"Total card {key}: {make_time_hms(sbt)}{msg}")
+        for key in store.names():
+            sbt, is_in = subtotal(store,key)
+            if is_in:
+                msg = " and clocked in"
+            else:
+                msg = ""
+            print(f"Total card {key}: {make_time_hms(sbt)}{msg}")
     else :
-        sbt, is_in = subtotal(card_full,name)
+        sbt, is_in = subtotal(store,name)
         if sbt != -1:
             if is_in:
                 msg = " and is clocked in"
@@ -411,12 +710,12 @@ def total(card_full, name="0"):
                 msg = ""
             print(f"Card {name} has {make_time_hms(sbt)}{msg}")
 
-def show_one(full_card, card_name):
+def show_one(store, card_name):
     """
     Displays the clock data on a single card.
 
     Arguments:
-      full_card (dict): the card json data 
+      store (JsonStore or SqliteStore): the store holding the cards
       number (str): the number of the card to show
     """
     before = ceil(21-(len(card_name)-1)/2)
@@ -428,13 +727,12 @@ def show_one(full_card, card_name):
         print("=", end="")
     print("")
     # check existance
-    if card_name not in full_card:
+    card = store.card(card_name)
+    if card is None:
         print(f"Card {card_name} does not exist.")
         print(f"--------------------------------------------------")
         return
 
-    card = full_card[card_name]
-
     for punch in card["punches"]:
         print(f'In: {make_time(punch["in"])}   Out: {make_time(punch["out"])}{" : " + punch["msg"] if "msg" in punch else ""}')
     
@@ -445,38 +743,39 @@ def show_one(full_card, card_name):
     
     # print a total for good measure
     print(f"--------------------------------------------------")
-    total(full_card, card_name)
+    total(store, card_name)
 
-def show(full_card, card_name):
+def show(store, card_name):
     """
     Shows time card data for the given card
 
     Arguments:
-      full_card (dict): the json object holding the card
+      store (JsonStore or SqliteStore): the store holding the cards
       card_number (str): String containing the number of the card to show, "0" to show all cards
     """
     if card_name == "0":
-        for key in full_card.keys():
-            show_one(full_card, key)
+        for key in store.names():
+            show_one(store, key)
             print("")
     
     else:
-        show_one(full_card, card_name)
+        show_one(store, card_name)
         
 
-def clear(full_card, card_name):
+def clear(store, card_name):
     """
     Requests confirmation, then (if affirmative) clears all clock data from the cards.
     TODO: The data is moved to a '.old' file, whose contents are lost
 
     Arguments:
-      full_card (dict): the json object holding the card
+      store (JsonStore or SqliteStore): the store holding the cards
       card_number (str): the number of the card to clear, "0" to clear all cards
     """
     # display the cards for good measure
-    show(full_card, card_name)
+    show(store, card_name)
 
-    if card_name != "0" and card_name not in full_card:
+    names = store.names()
+    if card_name != "0" and card_name not in names:
         print("Refusing to delete nonexistant card")
         return
 
@@ -486,23 +785,18 @@ def clear(full_card, card_name):
 
     #else
     if card_name == "0":
-        for key in full_card.keys():
+        for key in names:
             print(f"Deleting card {key}...")
-            if key not in full_card:
-                print("Refusing to delete nonexistant card")
-                continue
-            del full_card[key]
     else:
         print(f"Deleting card {card_name}...")
-        del full_card[card_name]
 
-    save_card_json(full_card)
+    store.record({"op": "clear", "card": card_name})
     print("Cards have been cleared")
 
 def main():
     cmd, card_num = 0, 0
     try:
-        cmd, card_num, msg, card = parseArgs()
+        cmd, card_num, msg, store = parseArgs()
         if msg != 0 and not cmd in MESSAGEABLE_COMMANDS:
             raise ValueError(f"Cannot provide message to `{cmd}` command")
     except ValueError as e:
@@ -515,24 +809,26 @@ def main():
         return 0
 
     if cmd == 'show' or cmd == 's':
-        show(card, card_num)
+        show(store, card_num)
     elif cmd == 'total' or cmd == 't':
-        total(card, card_num)
+        total(store, card_num)
     elif cmd == 'clear' or cmd == 'c':
-        clear(card, card_num)
+        clear(store, card_num)
     elif cmd == 'list' or cmd == 'ls':
-        list_cards(card)
+        list_cards(store)
     elif cmd == 'rename' or cmd == 'r':
         # in this case, message will be the new name
-        rename(card, card_num, msg)
+        rename(store, card_num, msg)
+    elif cmd == 'migrate':
+        migrate(store)
 
     if card_num == "0":
         card_num = "1"
         
     if cmd == 'in':
-        punch_in(card, card_num, msg)
+        punch_in(store, card_num, msg)
     elif cmd == 'out':
-        punch_out(card, card_num, msg)
+        punch_out(store, card_num, msg)
 
     return 0
 
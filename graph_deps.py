@@ -1,212 +1,1937 @@
 #!/usr/bin/env python3
 
-import networkx as nx
+# networkx and multiprocessing take a long time to import, so they and the
+# rarely needed modules are imported by the functions that need them
+
 import argparse as ap
+import ast
+import functools
 import glob
+import heapq
+import io
+import itertools
+import json
+import mmap
 import os
 import re
-
-import matplotlib.pyplot as plt
+import sys
+import time
+import warnings
+from array import array
+from collections import Counter, deque
+from contextlib import contextmanager
 
 exclude_list = []
 
-def build_cxx_dependency_graph(root):
+# the modules left out of python dependency graphs
+PY_EXCLUDES = {'os','sys','pickle','json','socket',
+    'functools','cvxopt','signal','PIL','traceback','pandas',
+    'numpy','_thread','threading','inspect','io','flask',
+    'flask_cas','matplotlib','Cryptodome','pytest','psutil',
+    'docker','git','argparse','subprocess','random','time',
+    'glob','importlib','shutil','collections','logging', 'requests',
+    'matplotlib.pyplot','builtins','uuid', 'sqlalchemy', 'flask_login',
+    'queue','socketserver','select','struct','urllib','webbrowser'}
+
+# the name of the scan cache file kept under the root
+CACHE_NAME = '.graph_deps_cache'
+CACHE_VERSION = 3
+
+# the name of the reachability index kept under the root
+INDEX_NAME = '.graph_deps_index'
+INDEX_VERSION = 2
+
+# the number of slowest files a profile lists
+SLOWEST_FILES = 10
+
+# the number of down and up passes the layered layout makes to reduce crossings
+LAYOUT_SWEEPS = 4
+
+# the horizontal and vertical space between nodes in svg pictures
+SVG_SPACING = (40, 80)
+
+# the buffer size for writing graphs
+WRITE_BUFFER = 1 << 20
+
+# files at least this big are mapped into memory rather than read
+MMAP_THRESHOLD = 1 << 16
+
+# whitespace within a line, so matches over a whole file stay on one line
+_hs = rb'[ \t\f\v\r]'
+
+# compile a regex pattern to match includes
+#re.compile(r'^\s*#include [<"]([^>"]+)[>"]') # including standard libraried
+_cxx_pattern = re.compile(rb'^%(hs)s*#%(hs)s*include%(hs)s*([<"])([^>"\n]+)[>"]' % {b'hs': _hs}, re.MULTILINE)
+# the extensions of c and c++ sources and headers
+CXX_EXTENSIONS = {'.h', '.hh', '.hpp', '.hxx', '.c', '.cc', '.cpp', '.cxx'}
+# compile a regex pattern to match imports
+_py_pattern = re.compile(rb'^(%(hs)s*import%(hs)s+(\S+))|^(%(hs)s*from%(hs)s+(\S+)%(hs)s+import%(hs)s+(\S+))'
+        % {b'hs': _hs}, re.MULTILINE)
+
+def _peak_rss_kb():
+    """gets the most memory this process, or any of its finished workers, has
+    held at once
+
+    Returns:
+        (int): the peak resident set size in kilobytes, or None where the
+        platform can't tell
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # macos counts in bytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+@contextmanager
+def _phase(profile, name):
+    """times the enclosed block, and records the seconds it took and the peak
+    memory after it in profile['phases'][name]
+
+    Arguments:
+        profile (dict): where to record the phase, or None to not bother
+        name (str): the name of the phase
+
+    Yields:
+        phase (dict): the record of the phase, for the block to add its counts
+        to, or None if there is no profile
+    """
+    if profile is None:
+        yield None
+        return
+    phase = profile.setdefault('phases', dict()).setdefault(name, dict())
+    start = time.perf_counter()
+    try:
+        yield phase
+    finally:
+        phase['seconds'] = phase.get('seconds', 0) + time.perf_counter() - start
+        phase['peak_rss_kb'] = _peak_rss_kb()
+
+def _map_files(func, files, jobs=1):
+    """applies func to each of the files, across a process pool if jobs > 1
+
+    Results come back in the same order as the files, so a graph built from
+    them is identical to the one a serial run would build.
+
+    Arguments:
+        func (callable): a module level function taking a single file path
+        files (list): the files to scan
+        jobs (int): the number of worker processes, 0 for one per cpu
+
+    Returns:
+        results (list): the result of func for each file, in order
+    """
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    if jobs <= 1 or len(files) < 2:
+        return [func(fl) for fl in files]
+    # hand out files in a few chunks per worker to keep the IPC overhead down
+    chunksize = max(1, len(files) // (jobs * 4))
+    import multiprocessing as mp
+    with mp.Pool(jobs) as pool:
+        return pool.map(func, files, chunksize)
+
+def _file_hash(fl):
+    """hashes the contents of a file, for cache entries which can't trust mtimes
+    """
+    import hashlib
+    with open(fl, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def load_scan_cache(root):
+    """loads the scan cache saved under root by an earlier run
+
+    Returns:
+        cache (dict): the cached scan results of each scanner, keyed by scanner
+        name then file path. Empty if there is no usable cache.
+    """
+    try:
+        with open(os.path.join(root, CACHE_NAME), 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return dict()
+    if cache.get('version') != CACHE_VERSION:
+        return dict()
+    return cache['scanners']
+
+def save_scan_cache(root, cache):
+    """saves the scan cache under root, replacing the old one atomically
+
+    Arguments:
+        root (str): the root of the directory that was analyzed
+        cache (dict): the cache, as returned by load_scan_cache
+    """
+    path = os.path.join(root, CACHE_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'scanners': cache}, f)
+    os.replace(path + '.tmp', path)
+
+def _profiled_scan(scan, fl):
+    """runs scan on a file, and measures it
+
+    Returns:
+        found: what scan found
+        seconds (float): how long the scan took
+        size (int): the bytes in the file
+    """
+    start = time.perf_counter()
+    found = scan(fl)
+    return found, time.perf_counter() - start, os.path.getsize(fl)
+
+def _try_scan(scan, fl):
+    """runs scan on a file that may be gone by the time it is read
+
+    Returns:
+        found: what scan found, or None if the file couldn't be read
+    """
+    try:
+        return scan(fl)
+    except OSError:
+        return None
+
+def _scan_files(scan, files, jobs=1, cache=None, use_hash=False, phase=None):
+    """runs scan over each of the files, skipping the ones that a cache says
+    haven't changed since they were last scanned
+
+    Arguments:
+        scan (callable): a module level function taking a single file path
+        files (list): the files to scan
+        jobs (int): the number of worker processes, 0 for one per cpu
+        cache (dict): cache entries for this scanner, keyed by file path. It is
+            updated in place, and entries for files that are gone are dropped.
+        use_hash (bool): trust a file's content hash instead of its mtime and size
+        phase (dict): if given, the files scanned, the bytes they held and the
+            slowest of them are recorded in it
+
+    Returns:
+        results (list): the result of scan for each file, in order
+    """
+    results = [None] * len(files)
+    keys = []
+    stale = []
+    if cache is None:
+        stale = list(range(len(files)))
+    else:
+        for i, fl in enumerate(files):
+            st = os.stat(fl)
+            key = [st.st_mtime_ns, st.st_size, _file_hash(fl) if use_hash else None]
+            keys.append(key)
+            entry = cache.get(fl)
+            if entry and (entry[2] == key[2] if use_hash else entry[:2] == key[:2]):
+                results[i] = entry[3]
+            else:
+                stale.append(i)
+
+    # only rescan the files that changed
+    stale_files = [files[i] for i in stale]
+    if phase is None:
+        for i, found in zip(stale, _map_files(scan, stale_files, jobs)):
+            results[i] = found
+    else:
+        measured = _map_files(functools.partial(_profiled_scan, scan), stale_files, jobs)
+        for i, (found, _, _) in zip(stale, measured):
+            results[i] = found
+        phase['files'] = len(files)
+        phase['scanned'] = len(stale)
+        phase['bytes'] = sum(size for _, _, size in measured)
+        slowest = heapq.nlargest(SLOWEST_FILES, zip(stale_files, measured), key=lambda item: item[1][1])
+        phase['slowest'] = [{'file': fl, 'seconds': seconds, 'bytes': size}
+                for fl, (_, seconds, size) in slowest]
+
+    if cache is not None:
+        cache.clear()
+        cache.update({fl: key + [found] for fl, key, found in zip(files, keys, results)})
+    return results
+
+@contextmanager
+def _read_bytes(fl):
+    """gives the contents of a file as bytes, without decoding them, mapping
+    big files into memory rather than copying them
+
+    Yields:
+        buf (bytes): the contents of fl, or an mmap of them
+    """
+    with open(fl, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < MMAP_THRESHOLD:
+            yield f.read()
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                yield buf
+
+def _scan_bytes(fl, token, pattern):
+    """runs a bytes pattern over a whole file, skipping files which don't
+    contain the token at all
+
+    Returns:
+        found (list): the groups of each match, decoded. Bytes that aren't
+        utf-8 are replaced rather than failing the scan.
+    """
+    with _read_bytes(fl) as buf:
+        if buf.find(token) < 0:
+            return []
+        found = pattern.findall(buf)
+    return [tuple(group.decode('utf-8', 'replace') for group in groups) for groups in found]
+
+def _scan_cxx_file(fl):
+    """scans a single c++ file for includes
+
+    Returns:
+        includes (list): a (delimiter, path) pair for each file which fl
+        includes, where the delimiter is `"` or `<`
+    """
+    return _scan_bytes(fl, b'include', _cxx_pattern)
+
+def read_compile_commands(path):
+    """reads the include search paths out of a compile_commands.json
+
+    The paths of every translation unit are merged, in the order they first
+    appear, since the graph is built for the whole project at once.
+
+    Arguments:
+        path (str): the compile_commands.json to read
+
+    Returns:
+        include_dirs (list): the absolute include search paths
+    """
+    import shlex
+    with open(path, 'r') as f:
+        entries = json.load(f)
+    include_dirs = []
+    for entry in entries:
+        args = entry['arguments'] if 'arguments' in entry else shlex.split(entry['command'])
+        directory = entry.get('directory', os.path.dirname(path))
+        for i, arg in enumerate(args):
+            for flag in ('-I', '-isystem', '-iquote'):
+                if arg == flag and i + 1 < len(args):
+                    include_dir = args[i+1]
+                elif arg.startswith(flag) and len(arg) > len(flag):
+                    include_dir = arg[len(flag):]
+                else:
+                    continue
+                include_dir = os.path.normpath(os.path.join(directory, include_dir))
+                if include_dir not in include_dirs:
+                    include_dirs.append(include_dir)
+                break
+    return include_dirs
+
+def build_cxx_include_index(files):
+    """indexes c++ files so that includes resolve without touching the disk
+
+    Arguments:
+        files (list): every c++ file found under the root
+
+    Returns:
+        paths (dict): a map from each file's absolute path to the file
+        suffixes (dict): a map from each trailing part of a file's path, like
+            `lib/foo.h` and `foo.h`, to the file. Suffixes shared by several
+            files map to None.
+    """
+    paths = dict()
+    suffixes = dict()
+    for fl in files:
+        full = os.path.abspath(fl)
+        paths[full] = fl
+        parts = full.split(os.sep)
+        for i in range(1, len(parts)):
+            suffix = os.path.join(*parts[i:])
+            suffixes[suffix] = None if suffix in suffixes else fl
+    return paths, suffixes
+
+def _resolve_cxx_includes(fl, includes, index, include_dirs):
+    """resolves the includes of a file the way the compiler searches for them
+
+    Quoted includes look next to the including file, then in the include
+    paths, then for a file in the project whose path ends the same way. Angle
+    includes only look in the include paths, so system headers are left out.
+
+    Arguments:
+        fl (str): the file which did the including
+        includes (list): the includes found by _scan_cxx_file
+        index (tuple): the index from build_cxx_include_index
+        include_dirs (tuple): the absolute include search paths
+
+    Returns:
+        edges (list): an edge from fl to each file it includes
+    """
+    paths, suffixes = index
+    here = os.path.dirname(os.path.abspath(fl))
+    edges = []
+    for delim, inc in includes:
+        search = (here,) + include_dirs if delim == '"' else include_dirs
+        for include_dir in search:
+            pth = paths.get(os.path.normpath(os.path.join(include_dir, inc)))
+            if pth:
+                break
+        else:
+            pth = suffixes.get(os.path.normpath(inc)) if delim == '"' else None
+        if pth:
+            edges.append((fl,pth))
+        elif delim == '"':
+            # leave the include as it was written, we can't find it
+            edges.append((fl,inc))
+    return edges
+
+def find_cxx_files(root):
+    """finds the c and c++ sources and headers under root"""
+    return [fl for fl in glob.glob(os.path.join(root,"**/*"), recursive=True)
+            if os.path.splitext(fl)[1] in CXX_EXTENSIONS]
+
+def build_cxx_dependency_graph(root, jobs=1, cache=False, cache_hash=False, include_dirs=(), compile_commands=None, engine='networkx', granularity='file', focus=None, profile=None):
     """
     Builds a dependency graph of the files in the project
 
+    Arguments:
+        root (str): the root of the directory to analyze
+        jobs (int): the number of processes to scan files with, 0 for one per cpu
+        cache (bool): reuse the scans of unchanged files from the cache under root
+        cache_hash (bool): decide whether files changed by content hash instead
+            of mtime and size
+        include_dirs (list): the include search paths, like the compiler's -I
+        compile_commands (str): a compile_commands.json to read more include
+            search paths from
+        engine (str): the kind of graph to build, one of GRAPH_ENGINES
+        granularity (str): 'file', or 'package' or 'dir:N' to collapse files
+            into their directories, see make_grouping
+        focus (str): with a granularity, a directory whose files are kept apart
+        profile (dict): if given, the time, peak memory and counts of the
+            globbing, parsing and resolving phases are recorded in it
+
     Returns:
         graph (nx.graph): a dependency graph of the files in the project, as promised.
         Edges are directed from the file that depends, to the file it depends on, 
         i.e. sinks in the graph represent files that are very depended on, and 
         sources are probably just main.
     """
-    # compule a regex pattern to match includes
-    #re.compile(r'^\s*#include [<"]([^>"]+)[>"]') # including standard libraried
-    pattern = re.compile(r'^\s*#include "([^"]+)"')
-
     # create a new graph object
-    graph = nx.DiGraph()
+    graph = GRAPH_ENGINES[engine]()
 
-    # get all the files we need
-    files = glob.glob(os.path.join(root,"**/*.h"), recursive=True) #+ glob.glob("**/*.cpp", recursive=True) + glob.glob("**/*.c", recursive=True)
+    # get all the files we need, headers and translation units both
+    with _phase(profile, 'glob') as phase:
+        files = find_cxx_files(root)
+        if phase is not None:
+            phase['files'] = len(files)
 
-    # for each file that we find
-    for fl in files:
-        # begin reading the file
-        with open(fl, 'r') as f:
-            # for each line
-            for line in f:
-                # for each thing that the file imports add a directed edge from this file to the imported file
-                # TODO we might need to resolve some paths here
-                graph.add_edges_from([(fl,dependent) for dependent in re.findall(pattern, line)])
-    for ex in exclude_list:
-        graph.remove_node(ex)
+    # scan each file we find
+    with _phase(profile, 'parse') as phase:
+        scans = load_scan_cache(root) if cache else None
+        found = _scan_files(_scan_cxx_file, files, jobs,
+                None if scans is None else scans.setdefault('cxx', dict()), cache_hash, phase)
+        if cache:
+            save_scan_cache(root, scans)
+
+    with _phase(profile, 'resolve') as phase:
+        # gather the places to look for includes
+        include_dirs = [os.path.abspath(include_dir) for include_dir in include_dirs]
+        if compile_commands:
+            include_dirs += [include_dir for include_dir in read_compile_commands(compile_commands)
+                    if include_dir not in include_dirs]
+
+        # for each thing that the file imports add a directed edge from this file to the imported file
+        index = build_cxx_include_index(files)
+        groups = make_grouping(root, files, granularity, focus)
+        weights = Counter()
+        for fl, includes in zip(files, found):
+            edges = [edge for edge in _resolve_cxx_includes(fl, includes, index, tuple(include_dirs))
+                    if not edge[0] in exclude_list and not edge[1] in exclude_list]
+            if groups is None:
+                graph.add_edges_from(edges)
+            else:
+                _group_edges(edges, groups, weights)
+        _add_weighted_edges(graph, weights)
+        if phase is not None:
+            phase['edges'] = graph.number_of_edges()
     return graph
 
-def build_py_dependency_graph(root):
+def _scan_py_file(fl):
+    """scans a single python file for imports
+
+    Returns:
+        imports (list): the groups of each import statement matched in fl
+    """
+    return _scan_bytes(fl, b'import', _py_pattern)
+
+# the nodes which can hold statements that may be imports
+_STMT_NODES = tuple(getattr(ast, name) for name in ('stmt', 'excepthandler', 'match_case') if hasattr(ast, name))
+
+def _find_import_nodes(body, found):
+    """collects the import statements in a block, and in the blocks nested in
+    it, in the order they are written
+    """
+    for node in body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            found.append(node)
+            continue
+        # only statements hold statements, so skip all the expressions
+        for _, value in ast.iter_fields(node):
+            if isinstance(value, list) and value and isinstance(value[0], _STMT_NODES):
+                _find_import_nodes(value, found)
+
+def _scan_py_file_ast(fl):
+    """scans a single python file for imports by parsing it
+
+    This catches the imports that the line regex misses, like `import a, b`
+    and parenthesized `from a import (b, c)`, and skips anything that only
+    looks like an import inside a string. Files that don't parse fall back on
+    the regex.
+
+    Returns:
+        imports (list): the groups of each import, in the form _scan_py_file
+        gives them, one per imported name
+    """
+    with open(fl, 'rb') as f:
+        source = f.read()
+    # no sense parsing a file that can't import anything
+    if b'import' not in source:
+        return []
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            tree = ast.parse(source, fl)
+    except (SyntaxError, ValueError):
+        return _scan_py_file(fl)
+
+    nodes = []
+    _find_import_nodes(tree.body, nodes)
+    imports = []
+    for node in nodes:
+        if isinstance(node, ast.Import):
+            imports.extend([('import ' + alias.name, alias.name, '', '', '') for alias in node.names])
+        else:
+            module = '.' * node.level + (node.module or '')
+            imports.extend([('', '', 'from ' + module, module, alias.name) for alias in node.names])
+    return imports
+
+# the python import scanners, by parser name
+PY_SCANNERS = {
+    'regex': _scan_py_file,
+    'ast': _scan_py_file_ast,
+}
+
+def build_py_module_index(files):
+    """indexes python files by the module path they can be imported as
+
+    Keys are normalized paths with the extension dropped, so `a/b.py` is
+    indexed under `a/b`, and a package `a/b/__init__.py` is indexed under its
+    directory `a/b`. Packages win over a module of the same name, as they do
+    for the interpreter.
+
+    Arguments:
+        files (list): every python file found under the root
+
+    Returns:
+        index (dict): a map from module paths to the file defining them
+    """
+    index = dict()
+    packages = dict()
+    for fl in files:
+        head, tail = os.path.split(os.path.normpath(fl))
+        if tail == '__init__.py':
+            packages[head] = fl
+        else:
+            index[os.path.join(head, tail[:-3])] = fl
+    index.update(packages)
+    return index
+
+def _lookup_module(index, base, dotted):
+    """finds the file for a dotted module name imported from the base directory
+
+    Returns:
+        (str): the file defining the module, or None if it isn't in the index
+    """
+    return index.get(os.path.normpath(os.path.join(base, *dotted.split('.'))))
+
+def _resolve_py_imports(fl, imports, index, root):
+    """resolves the imports of a file against the module index
+
+    Absolute imports are looked up next to the importing file first, then from
+    the root. Relative imports climb one directory for each dot past the first.
+
+    Arguments:
+        fl (str): the file which did the importing
+        imports (list): the import groups found by _scan_py_file
+        index (dict): the module index from build_py_module_index
+        root (str): the root of the directory being analyzed
+
+    Returns:
+        edges (list): an edge from fl to each module it imports
+    """
+    here = os.path.dirname(fl)
+    bases = (here,) if os.path.normpath(here) == os.path.normpath(root) else (here, root)
+    edges = []
+    for groups in imports:
+        edge = None
+        # if this is import <package>
+        if groups[0]:
+            for base in bases:
+                pth = _lookup_module(index, base, groups[1])
+                if pth:
+                    edge = (fl,pth)
+                    break
+            else:
+                # imports of the form import <builtin-pkg>
+                edge = (fl,groups[1])
+        else:
+            # then this is a from <pkg> import <pkg or name>
+            module = groups[3].lstrip('.')
+            name = groups[4].strip('(),')
+            level = len(groups[3]) - len(module)
+            if level:
+                # climb out of the packages for a relative import
+                base = here
+                for _ in range(level - 1):
+                    base = os.path.join(base, os.pardir)
+                search = (base,)
+            else:
+                search = bases
+            pth = None
+            for base in search:
+                if module:
+                    # from <pkg> import <sub>, then from <pkg> import <name>
+                    pth = _lookup_module(index, base, module + '.' + name) or _lookup_module(index, base, module)
+                else:
+                    # from . import <sub>
+                    pth = _lookup_module(index, base, name)
+                if pth:
+                    break
+            if pth:
+                edge = (fl,pth)
+            elif level:
+                # from . import <name>, or a relative import that left the tree
+                # not interesting
+                continue
+            else:
+                # imports of the form "from <pkg>.<sub> import <name>"
+                edge = (fl,module.split('.')[0])
+        if edge and not edge[0] in exclude_list and not edge[1] in exclude_list:
+            edges.append(edge)
+    return edges
+
+def find_py_files(root):
+    """finds the python files under root"""
+    return glob.glob(os.path.join(root,"**/*.py"), recursive=True)
+
+def build_py_dependency_graph(root, jobs=1, cache=False, cache_hash=False, parser='regex', engine='networkx', granularity='file', focus=None, profile=None):
     """
     builds a dependency grapn of the files in the project
 
+    Arguments:
+        root (str): the root of the directory to analyze
+        jobs (int): the number of processes to scan files with, 0 for one per cpu
+        cache (bool): reuse the scans of unchanged files from the cache under root
+        cache_hash (bool): decide whether files changed by content hash instead
+            of mtime and size
+        parser (str): how to find imports, one of PY_SCANNERS
+        engine (str): the kind of graph to build, one of GRAPH_ENGINES
+        granularity (str): 'file', or 'package' or 'dir:N' to collapse files
+            into their directories, see make_grouping
+        focus (str): with a granularity, a directory whose files are kept apart
+        profile (dict): if given, the time, peak memory and counts of the
+            globbing, parsing and resolving phases are recorded in it
+
     Returns:
         graph (nx.graph): a dependency graph of the files in the project, as promised.
         Edges are directed from the file that depends, to the file it depends on, 
         i.e. sinks in the graph represent files that are very depended on, and 
         sources are probably just main.
     """
-    # compule a regex pattern to match imports
-    pattern = re.compile(r'^(\s*import\s+(\S+))|^(\s*from\s+(\S+)\s+import\s+(\S+))')
-
     # create a new graph object
-    graph = nx.DiGraph()
+    graph = GRAPH_ENGINES[engine]()
 
     # get all the files we need
-    files = glob.glob(os.path.join(root,"**/*.py"), recursive=True)
+    with _phase(profile, 'glob') as phase:
+        files = find_py_files(root)
+        if phase is not None:
+            phase['files'] = len(files)
     # print(files)
 
-    # for each of the files we find
-    for fl in files:
-        edges = []
-        # begin reading the file
-        with open(fl, 'r') as f:
-            # print('\n',fl)
-            # for each line:
-            for line in f:
-                # find import matches
-                matches = re.findall(pattern, line)
-                # for each match we found
-                for match in matches:
-                    edge = None
-                    # get the groups
-                    groups = match
-                    # print(match[0] if match[0] else match [2])
-                    # if this is import <package>
-                    if groups[0]:
-                        # do path resolution to find out if this file is in here or a system library
-                        the_path = os.path.join(*fl.split(os.sep)[:-1],groups[1].replace('.',os.sep))+'.py'
-                        # print(f"trying import {the_path}")
-                        # if this path is there, then save it as that path
-                        if the_path in files:
-                            edge = (fl,the_path)
-                            # print(f'0) using import {the_path}')
-                        else:
-                            # imports of the form import <builtin-pkg>
-                            # print(f'1) using import {groups[1]}')
-                            edge = (fl,groups[1])
-                    else:
-                        # then this is a from <pkg> import <pkg or name>
-                        if groups[3].startswith('.'):
-                            # if the base package is a relative import
-                            the_path = os.path.join(*fl.split(os.sep)[:-1],'.'+groups[3][1:].replace('.',os.sep))
-                        else:
-                            # the package is not a relative import
-                            the_path = os.path.join(*fl.split(os.sep)[:-1],groups[3].replace('.',os.sep))
-                        # print(f"trying from {groups[3]} import {groups[4]}")
-                        if groups[3].startswith('.') and os.path.join(*fl.split(os.sep)[:-1],groups[3][1:].replace('.', os.sep), groups[4]+'.py') in files:
-                            # import of the form: from .<pkg> import <sub>
-                            pth = os.path.join(*fl.split(os.sep)[:-1],groups[3][1:].replace('.', os.sep), groups[4]+'.py')
-                            # print(f"2) using import {pth}")
-                            edge = (fl,pth)
-                        elif groups[3].startswith('.') and os.path.join(*fl.split(os.sep)[:-1],groups[3][1:].replace('.',os.sep)+'.py') in files:
-                            # import of the form: from .<pkg>.<sub> import <name>
-                            pth = os.path.join(*fl.split(os.sep)[:-1],groups[3][1:].replace('.',os.sep)+'.py')
-                            # print(f"3) using import {pth}")
-                            edge = (fl,pth)
-                        elif groups[3].startswith('.') and os.path.join(*fl.split(os.sep)[:-1],groups[3][1:]+'.py') in files:
-                            # import of the form: from .<pkg> import <name>
-                            pth = os.path.join(*fl.split(os.sep)[:-1],groups[3][1:]+'.py')
-                            # print(f"4) using import {pth}")
-                            edge = (fl,pth)
-                        elif groups[3] == '.' and os.path.join(*fl.split(os.sep)[:-1],groups[4]+'.py') in files:
-                            # imports of the form: from . import <pkg>
-                            pth = os.path.join(*fl.split(os.sep)[:-1],groups[4]+'.py')
-                            # print(f"5) using import {pth}")
-                            edge = (fl,pth)
-                        elif groups[3] == '.':
-                            # then it has the form: from . import <name>
-                            # not interesting
-                            # pth = os.path.join(*fl.split(os.sep)[:-1],'__init__.py')
-                            # print(f"6) usint import {pth}")
-                            # edge = (fl,pth)
-                            continue
-                        else:
-                            # imports of the form "from <pkg>.<sub> import <name>"
-                            # print(f"6) using import {groups[3].split('.')[0]}")
-                            edge = (fl,groups[3].split('.')[0])
-                    if edge and not edge[0] in exclude_list and not edge[1] in exclude_list:
-                        edges.append(edge)
-        # print(edges)
-        graph.add_edges_from(edges)
+    # scan each of the files we find
+    with _phase(profile, 'parse') as phase:
+        scans = load_scan_cache(root) if cache else None
+        found = _scan_files(PY_SCANNERS[parser], files, jobs,
+                None if scans is None else scans.setdefault('py-' + parser, dict()), cache_hash, phase)
+        if cache:
+            save_scan_cache(root, scans)
+
+    # resolve the imports and merge the edges in file order
+    with _phase(profile, 'resolve') as phase:
+        index = build_py_module_index(files)
+        groups = make_grouping(root, files, granularity, focus)
+        weights = Counter()
+        for fl, imports in zip(files, found):
+            edges = _resolve_py_imports(fl, imports, index, root)
+            # print(edges)
+            if groups is None:
+                graph.add_edges_from(edges)
+            else:
+                _group_edges(edges, groups, weights)
+        _add_weighted_edges(graph, weights)
+        if phase is not None:
+            phase['edges'] = graph.number_of_edges()
 
     return graph
 
-def visualize(graph, path):
-    options = {
-        'node_color': 'blue',
-        'node_size': 100,
-        'width': 2,
-        'font_size': 8
-    }
-    from networkx.drawing.nx_pylab import draw_planar
-    try:
-        draw_planar(graph)
-        plt.savefig(path+'.png')
-    except:
-        print('planar print failed')
-    #   print("Bruh, this is one h*** of a dependency graph. Thes should be trees, not flipping K_12!!")
-    #   plt.draw()
-    # plt.subplot(111)
-        # nx.draw(graph, with_labels=True, font_weight='bold')
-        write_gv(graph, path+'gv')
+def parse_granularity(text):
+    """checks a granularity given on the command line
+
+    Returns:
+        granularity (str): 'file', 'package', or 'dir:N' for a positive N
+    """
+    if text in {'file', 'package'}:
+        return text
+    kind, _, depth = text.partition(':')
+    if kind != 'dir' or not depth.isdigit() or int(depth) < 1:
+        raise ValueError(f"Unsupported granularity: {text}")
+    return f'dir:{int(depth)}'
+
+def make_grouping(root, files, granularity='file', focus=None):
+    """works out the node that each file is collapsed into
+
+    Arguments:
+        root (str): the root of the project
+        files (list): the files of the project. Other nodes, like modules from
+            outside the project, are left alone.
+        granularity (str): 'file' to keep files apart, 'package' to collapse
+            them into the directory they are in, or 'dir:N' to collapse them
+            into their first N directories under the root
+        focus (str): a directory whose files are kept apart whatever the
+            granularity, to drill down into one package
+
+    Returns:
+        groups (dict): the node of each file, or None to keep files as nodes
+    """
+    granularity = parse_granularity(granularity)
+    if granularity == 'file':
+        return None
+    focus = os.path.abspath(focus) + os.sep if focus else None
+    groups = dict()
+    for fl in files:
+        if focus and os.path.abspath(fl).startswith(focus):
+            groups[fl] = fl
+        elif granularity == 'package':
+            groups[fl] = os.path.dirname(fl) or root
+        else:
+            dirs = os.path.relpath(fl, root).split(os.sep)[:-1]
+            groups[fl] = os.path.join(root, *dirs[:int(granularity[4:])])
+    return groups
+
+def _group_edges(edges, groups, weights):
+    """counts the edges between the groups that their ends fall in, dropping
+    the ones that collapsing the graph made into loops
+
+    Arguments:
+        edges (list): the (from, to) edges of the file level graph
+        groups (dict): the group of each file, from make_grouping
+        weights (Counter): the count of edges between each pair of groups,
+            updated in place
+    """
+    for u, v in edges:
+        gu, gv = groups.get(u, u), groups.get(v, v)
+        if gu != gv or u == v:
+            weights[gu, gv] += 1
+
+def _add_weighted_edges(graph, weights):
+    """adds the counted edges to a graph, with their counts as weights"""
+    graph.add_edges_from((u, v, {'weight': weight}) for (u, v), weight in weights.items())
+
+def open_output(path):
+    """opens a file to write a graph to through a large buffer, compressing it
+    with gzip if the path ends in .gz
+
+    Arguments:
+        path (str): the file to write
+
+    Returns:
+        f (file): a text file open for writing
+    """
+    if path.endswith('.gz'):
+        import gzip
+        return io.TextIOWrapper(io.BufferedWriter(gzip.open(path, 'wb', compresslevel=6), WRITE_BUFFER),
+                encoding='utf-8')
+    return open(path, 'w', buffering=WRITE_BUFFER, encoding='utf-8')
+
+def _write_lines(f, lines):
+    """writes lines in batches, so huge graphs take few calls to write, but
+    are never held in memory all at once
+    """
+    while True:
+        batch = ''.join(itertools.islice(lines, 4096))
+        if not batch:
+            return
+        f.write(batch)
+
+def _dot_quote(name):
+    """quotes a node name for graphviz"""
+    return '"' + name.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def _weighted_edges(graph):
+    """yields each edge of a graph as a (from, to, weight) triple, the weight
+    None where the graph isn't weighted
+    """
+    if isinstance(graph, CompactGraph):
+        return ((u, v, None) for u, v in graph.edges())
+    return graph.edges(data='weight')
 
 def write_gv(graph, path):
     """writes the given graph to a graphviz file with the specified name
     """
-    with open(path, 'w+') as f:
+    with open_output(path) as f:
         f.write('digraph dependency_graph {\n')
         f.write('    graph [nodesep="1", ranksep="2"];\n')
-        f.write('    splines="false";')
+        f.write('    splines="false";\n')
         f.write('    node [shape = circle];\n')
-        edges = list(graph.edges())
-        for edge in edges:
-            f.write(f'    "{edge[0]}" -> "{edge[1]}";\n')
-        f.write('}')
+        _write_lines(f, (f'    {_dot_quote(u)} -> {_dot_quote(v)};\n' if weight is None else
+                f'    {_dot_quote(u)} -> {_dot_quote(v)} [label="{weight}", weight={weight}];\n'
+                for u, v, weight in _weighted_edges(graph)))
+        f.write('}\n')
+
+def write_json(graph, path):
+    """writes the given graph as a json object mapping each node to the list
+    of nodes it depends on
+    """
+    with open_output(path) as f:
+        f.write('{')
+        _write_lines(f, (f'{"," if i else ""}\n  {json.dumps(node)}: {json.dumps(list(graph.successors(node)))}'
+                for i, node in enumerate(graph.nodes())))
+        f.write('\n}\n')
+
+def write_graphml(graph, path):
+    """writes the given graph as graphml
+    """
+    from xml.sax.saxutils import quoteattr
+    with open_output(path) as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+        f.write('  <key id="weight" for="edge" attr.name="weight" attr.type="int"/>\n')
+        f.write('  <graph id="dependency_graph" edgedefault="directed">\n')
+        _write_lines(f, (f'    <node id={quoteattr(node)}/>\n' for node in graph.nodes()))
+        _write_lines(f, (f'    <edge source={quoteattr(u)} target={quoteattr(v)}/>\n' if weight is None else
+                f'    <edge source={quoteattr(u)} target={quoteattr(v)}><data key="weight">{weight}</data></edge>\n'
+                for u, v, weight in _weighted_edges(graph)))
+        f.write('  </graph>\n')
+        f.write('</graphml>\n')
+
+def write_edgelist(graph, path):
+    """writes the given graph as one tab separated edge per line, followed by
+    its weight if the graph is weighted
+    """
+    with open_output(path) as f:
+        _write_lines(f, (f'{u}\t{v}\n' if weight is None else f'{u}\t{v}\t{weight}\n'
+                for u, v, weight in _weighted_edges(graph)))
+
+def layered_layout(graph, sweeps=LAYOUT_SWEEPS):
+    """lays a graph out in layers, sugiyama style, with what depends on
+    something above it
+
+    Cycles are broken by setting aside the edges that close them in a depth
+    first search. Each node is then ranked by the longest path to it from a
+    node that nothing depends on, in linear time, and the order within each
+    layer is improved by a bounded number of barycenter sweeps, down then up.
+    No dummy nodes are added for edges that span layers, which keeps the
+    layout linear in the size of the graph.
+
+    Arguments:
+        graph (nx.DiGraph): the dependency graph, or a CompactGraph
+        sweeps (int): the number of down and up passes to reduce crossings with
+
+    Returns:
+        layers (list): the nodes of each layer, from the top, in order
+        back (set): the edges set aside to break cycles, which point up or
+        along a layer
+    """
+    names = list(graph.nodes())
+    ids = {name: i for i, name in enumerate(names)}
+    n = len(names)
+    succ = [[] for _ in range(n)]
+    for u, v in graph.edges():
+        succ[ids[u]].append(ids[v])
+
+    # set aside the edges back onto the depth first search stack
+    back = set()
+    state = bytearray(n)
+    for root in range(n):
+        if state[root]:
+            continue
+        state[root] = 1
+        stack = [(root, iter(succ[root]))]
+        while stack:
+            u, children = stack[-1]
+            for v in children:
+                if not state[v]:
+                    state[v] = 1
+                    stack.append((v, iter(succ[v])))
+                    break
+                elif state[v] == 1:
+                    back.add((u, v))
+            else:
+                state[u] = 2
+                stack.pop()
+    down = [[v for v in succ[u] if (u, v) not in back] for u in range(n)]
+
+    # rank by the longest path from the top, in topological order
+    indegree = array('i', [0]) * n
+    for vs in down:
+        for v in vs:
+            indegree[v] += 1
+    rank = array('i', [0]) * n
+    queue = deque(u for u in range(n) if not indegree[u])
+    while queue:
+        u = queue.popleft()
+        for v in down[u]:
+            rank[v] = max(rank[v], rank[u] + 1)
+            indegree[v] -= 1
+            if not indegree[v]:
+                queue.append(v)
+    up = [[] for _ in range(n)]
+    for u in range(n):
+        for v in down[u]:
+            up[v].append(u)
+
+    layers = [[] for _ in range(max(rank) + 1 if n else 0)]
+    for u in range(n):
+        layers[rank[u]].append(u)
 
-def statistics(graph, reduce=True, verb=True):
+    # order each layer by the mean position of its neighbors in the layers
+    # already placed, positions being scaled to the width of their layer
+    x = array('d', [0.0]) * n
+    def place(layer):
+        for slot, u in enumerate(layer):
+            x[u] = (slot + 0.5) / len(layer)
+    for layer in layers:
+        place(layer)
+    for _ in range(sweeps):
+        for order, neighbors in ((layers[1:], up), (layers[-2::-1], down)):
+            for layer in order:
+                layer.sort(key=lambda u: sum(x[v] for v in neighbors[u]) / len(neighbors[u]) if neighbors[u] else x[u])
+                place(layer)
+    return [[names[u] for u in layer] for layer in layers], {(names[u], names[v]) for u, v in back}
+
+def write_svg(graph, path):
+    """draws the given graph as an svg picture, laid out in layers by
+    layered_layout. Edges that close cycles are drawn in red.
+    """
+    from xml.sax.saxutils import escape, quoteattr
+    layers, back = layered_layout(graph)
+    dx, dy = SVG_SPACING
+    widest = max(map(len, layers), default=0)
+    pos = dict()
+    for rank, layer in enumerate(layers):
+        offset = (widest - len(layer)) / 2
+        for slot, node in enumerate(layer):
+            pos[node] = (dx * (offset + slot + 1), dy * (rank + 1))
+
+    def edge(u, v):
+        (x1, y1), (x2, y2) = pos[u], pos[v]
+        mid = (y1 + y2) / 2
+        color = ' class="back"' if (u, v) in back else ''
+        return f'  <path{color} d="M{x1:.1f},{y1} C{x1:.1f},{mid} {x2:.1f},{mid} {x2:.1f},{y2}"/>\n'
+
+    def node(name):
+        x, y = pos[name]
+        label = escape(os.path.basename(name.rstrip('/\\')) or name)
+        return (f'  <g transform="translate({x:.1f},{y})"><title>{escape(name)}</title>'
+                f'<circle r="4"/><text x="6" y="-6">{label}</text></g>\n')
+
+    with open_output(path) as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{dx * (widest + 1):.0f}" '
+                f'height="{dy * (len(layers) + 1)}" font-family="sans-serif" font-size="8">\n')
+        f.write('  <style>path { fill: none; stroke: #999; stroke-width: 0.5; } path.back { stroke: #d22; } '
+                'circle { fill: #36c; } text { transform: rotate(-30deg); }</style>\n')
+        _write_lines(f, (edge(u, v) for u, v in graph.edges()))
+        _write_lines(f, (node(name) for layer in layers for name in layer))
+        f.write('</svg>\n')
+
+def visualize(graph, path):
+    """draws the graph as an svg picture at path + '.svg'"""
+    write_svg(graph, path + '.svg')
+
+# the graph writers and the extension of the files they write, by format name
+WRITERS = {
+    'dot': (write_gv, 'gv'),
+    'json': (write_json, 'json'),
+    'graphml': (write_graphml, 'graphml'),
+    'edgelist': (write_edgelist, 'tsv'),
+    'svg': (write_svg, 'svg'),
+}
+
+class CompactGraph:
+    """a directed graph which interns its nodes to integer ids and keeps its
+    adjacency in compressed sparse row arrays
+
+    It takes a few bytes per edge where networkx takes hundreds, so it can
+    hold graphs of millions of edges. It supports the part of the nx.DiGraph
+    interface that graph_deps uses, and to_networkx when more is needed.
+    """
+
+    def __init__(self, names=None, ids=None):
+        """
+        Arguments:
+            names (list): the nodes to start with, in id order
+            ids (dict): the id of each of the names, if already known
+        """
+        self.names = list() if names is None else names
+        self.ids = {name: i for i, name in enumerate(self.names)} if ids is None else ids
+        # edges are appended here, then packed into offsets and targets
+        self._src = array('i')
+        self._dst = array('i')
+        self._offsets = None
+        self._targets = None
+
+    def _intern(self, name):
+        """gets the id of a node, adding the node if it is new"""
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+    def add_edges_from(self, edges):
+        """adds each (from, to) pair of edges, adding their nodes as needed.
+        Edge attributes, like weights, are not kept."""
+        if self._offsets is not None:
+            # unpack so new edges go after the old ones
+            for i in range(len(self._offsets) - 1):
+                self._src.extend([i] * (self._offsets[i+1] - self._offsets[i]))
+            self._dst = self._targets
+            self._offsets = self._targets = None
+        for u, v, *_ in edges:
+            self._src.append(self._intern(u))
+            self._dst.append(self._intern(v))
+
+    def _csr(self):
+        """packs the edges into compressed sparse row form, dropping repeats
+
+        Returns:
+            offsets (array): the successors of node i are targets[offsets[i]:offsets[i+1]]
+            targets (array): the successor ids of every node, in the order added
+        """
+        if self._offsets is None:
+            n = len(self.names)
+            # counting sort the edges by their source, which keeps them in order
+            starts = array('q', [0]) * (n + 1)
+            for u in self._src:
+                starts[u+1] += 1
+            for i in range(n):
+                starts[i+1] += starts[i]
+            slots = array('i', [0]) * len(self._src)
+            fill = array('q', starts)
+            for u, v in zip(self._src, self._dst):
+                slots[fill[u]] = v
+                fill[u] += 1
+            del fill
+
+            # drop repeated edges, keeping the first
+            offsets = array('q', [0]) * (n + 1)
+            targets = array('i')
+            last = array('i', [-1]) * n
+            for u in range(n):
+                for v in slots[starts[u]:starts[u+1]]:
+                    if last[v] != u:
+                        last[v] = u
+                        targets.append(v)
+                offsets[u+1] = len(targets)
+            self._offsets, self._targets = offsets, targets
+            self._src, self._dst = array('i'), array('i')
+        return self._offsets, self._targets
+
+    def _successor_ids(self, i):
+        offsets, targets = self._csr()
+        return targets[offsets[i]:offsets[i+1]]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def nodes(self):
+        return list(self.names)
+
+    def number_of_edges(self):
+        return len(self._csr()[1])
+
+    def edges(self):
+        """yields each edge as a (from, to) pair of node names"""
+        offsets, targets = self._csr()
+        names = self.names
+        for u in range(len(names)):
+            for v in targets[offsets[u]:offsets[u+1]]:
+                yield names[u], names[v]
+
+    def successors(self, name):
+        return [self.names[v] for v in self._successor_ids(self.ids[name])]
+
+    def has_edge(self, u, v):
+        return u in self.ids and v in self.ids and self.ids[v] in self._successor_ids(self.ids[u])
+
+    def to_networkx(self):
+        """builds the equivalent nx.DiGraph"""
+        import networkx as nx
+        graph = nx.DiGraph()
+        graph.add_nodes_from(self.names)
+        graph.add_edges_from(self.edges())
+        return graph
+
+def _compact_sccs(graph):
+    """finds the strongly connected components of a CompactGraph with an
+    iterative Tarjan's algorithm
+
+    Returns:
+        comp (array): the component number of each node
+        sccs (list): the node ids of each component, in reverse topological
+        order, so a component comes after everything it depends on
+    """
+    offsets, targets = graph._csr()
+    n = len(graph.names)
+    index = array('i', [-1]) * n
+    low = array('i', [0]) * n
+    comp = array('i', [-1]) * n
+    stack = []
+    sccs = []
+    counter = 0
+    for root in range(n):
+        if index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        # each frame is a node and the position of the next successor to visit
+        work = [(root, offsets[root])]
+        while work:
+            u, pos = work[-1]
+            if pos < offsets[u+1]:
+                work[-1] = (u, pos + 1)
+                v = targets[pos]
+                if index[v] == -1:
+                    index[v] = low[v] = counter
+                    counter += 1
+                    stack.append(v)
+                    work.append((v, offsets[v]))
+                elif comp[v] == -1 and index[v] < low[u]:
+                    # v is still on the stack
+                    low[u] = index[v]
+                continue
+            work.pop()
+            if work and low[u] < low[work[-1][0]]:
+                low[work[-1][0]] = low[u]
+            if low[u] == index[u]:
+                scc = []
+                while True:
+                    v = stack.pop()
+                    comp[v] = len(sccs)
+                    scc.append(v)
+                    if v == u:
+                        break
+                sccs.append(scc)
+    return comp, sccs
+
+def _compact_find_cycles(graph, samples):
+    """find_cycles for a CompactGraph"""
+    comp, sccs = _compact_sccs(graph)
+    names = graph.names
+    cyclic = []
+    cycles = []
+    for c, scc in enumerate(sccs):
+        if len(scc) == 1 and scc[0] not in graph._successor_ids(scc[0]):
+            continue
+        cyclic.append({names[i] for i in scc})
+        seen = set()
+        for start in sorted(scc, key=names.__getitem__)[:samples * 2]:
+            # breadth first search for the shortest way back to start
+            parents = {start: -1}
+            queue = deque([start])
+            cycle = []
+            while queue and not cycle:
+                u = queue.popleft()
+                for v in graph._successor_ids(u):
+                    if v == start:
+                        cycle = [u]
+                        while parents[cycle[-1]] != -1:
+                            cycle.append(parents[cycle[-1]])
+                        cycle.reverse()
+                        break
+                    if comp[v] == c and v not in parents:
+                        parents[v] = u
+                        queue.append(v)
+            pivot = cycle.index(min(cycle, key=names.__getitem__))
+            key = tuple(cycle[pivot:] + cycle[:pivot])
+            if key not in seen:
+                seen.add(key)
+                cycles.append([names[i] for i in key])
+            if len(seen) >= samples:
+                break
+    return cyclic, cycles
+
+def _compact_reduce(graph):
+    """reduce_graph for a CompactGraph
+
+    The descendants of each component of the condensation are kept as bitsets,
+    built sinks first, so an edge between components is superfluous when its
+    target is already a descendant of another of the source's successors.
+
+    Returns:
+        reduced (CompactGraph): the graph without its superfluous edges
+        superfluous (set): the edges that were removed
+    """
+    offsets, targets = graph._csr()
+    comp, sccs = _compact_sccs(graph)
+    children = []
+    parents = array('i', [0]) * len(sccs)
+    for c, scc in enumerate(sccs):
+        found = {comp[v] for u in scc for v in targets[offsets[u]:offsets[u+1]]}
+        found.discard(c)
+        for child in found:
+            parents[child] += 1
+        children.append(found)
+
+    descendants = [0] * len(sccs)
+    kept = [None] * len(sccs)
+    for c in range(len(sccs)):
+        # what can be reached through some other child
+        reach = 0
+        for child in children[c]:
+            reach |= descendants[child]
+        kept[c] = {child for child in children[c] if not (reach >> child) & 1}
+        for child in children[c]:
+            reach |= 1 << child
+            # let go of the bitsets nothing else will ask for
+            parents[child] -= 1
+            if not parents[child]:
+                descendants[child] = 0
+        descendants[c] = reach
+    del children, descendants
+
+    # the reduced graph shares the node names, and is packed as it's built
+    names = graph.names
+    reduced = CompactGraph(names, graph.ids)
+    reduced._offsets = array('q', [0]) * (len(names) + 1)
+    reduced._targets = array('i')
+    superfluous = set()
+    for u in range(len(names)):
+        for v in targets[offsets[u]:offsets[u+1]]:
+            if comp[u] == comp[v] or comp[v] in kept[comp[u]]:
+                reduced._targets.append(v)
+            else:
+                superfluous.add((names[u], names[v]))
+        reduced._offsets[u+1] = len(reduced._targets)
+    return reduced, superfluous
+
+def _compact_components(graph):
+    """finds the weakly connected components of a CompactGraph by union-find
+
+    Returns:
+        components (list): the nodes of each component, as sets of names
+    """
+    offsets, targets = graph._csr()
+    n = len(graph.names)
+    parent = array('i', range(n))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for u in range(n):
+        for v in targets[offsets[u]:offsets[u+1]]:
+            a, b = find(u), find(v)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+    components = dict()
+    for i in range(n):
+        components.setdefault(find(i), set()).add(graph.names[i])
+    return list(components.values())
+
+def _shortest_cycle(graph, start, members):
+    """finds a shortest cycle through start, with a breadth first search that
+    stays inside start's strongly connected component
+
+    Arguments:
+        graph (nx.DiGraph): the dependency graph
+        start (str): the node the cycle must pass through
+        members (set): the nodes of start's strongly connected component
+
+    Returns:
+        cycle (list): the nodes of the cycle, beginning at start
+    """
+    parents = {start: None}
+    queue = deque([start])
+    while queue:
+        node = queue.popleft()
+        for succ in graph.successors(node):
+            if succ == start:
+                # walk back up the search to recover the path
+                cycle = [node]
+                while parents[cycle[-1]] is not None:
+                    cycle.append(parents[cycle[-1]])
+                return cycle[::-1]
+            if succ in members and succ not in parents:
+                parents[succ] = node
+                queue.append(succ)
+    return []
+
+def find_cycles(graph, samples=3):
+    """finds the dependency cycles in a graph by its strongly connected
+    components, which takes linear time, however tangled the graph is
+
+    Arguments:
+        graph (nx.DiGraph): the dependency graph
+        samples (int): the most shortest cycles to find in each component
+
+    Returns:
+        sccs (list): the components which contain a cycle, as sets of nodes
+        cycles (list): a few shortest cycles from each of those components
+    """
+    if isinstance(graph, CompactGraph):
+        return _compact_find_cycles(graph, samples)
+    import networkx as nx
+    sccs = [scc for scc in nx.strongly_connected_components(graph)
+            if len(scc) > 1 or graph.has_edge(*(next(iter(scc)),) * 2)]
+    cycles = []
+    for scc in sccs:
+        cycles += _sample_cycles(graph, scc, samples)
+    return sccs, cycles
+
+def _sample_cycles(graph, scc, samples):
+    """finds a few distinct shortest cycles in a strongly connected component
+
+    Returns:
+        cycles (list): the cycles, each beginning at its least node
+    """
+    cycles = []
+    seen = set()
+    # every node is on a cycle, so try a few as starting points
+    for start in itertools.islice(sorted(scc), samples * 2):
+        cycle = _shortest_cycle(graph, start, scc)
+        # the same cycle can be found from each of its nodes
+        pivot = cycle.index(min(cycle))
+        key = tuple(cycle[pivot:] + cycle[:pivot])
+        if key not in seen:
+            seen.add(key)
+            cycles.append(list(key))
+        if len(seen) >= samples:
+            break
+    return cycles
+
+def reduce_graph(graph):
+    """performs a transitive reduction which tolerates cycles
+
+    The reduction is done on the condensation of the graph, where each
+    strongly connected component is a single node, which is always acyclic.
+    Edges inside a component are all kept, and an edge between components is
+    kept if the reduced condensation kept an edge between those components.
+    On an acyclic graph this is the plain transitive reduction.
+
+    Arguments:
+        graph (nx.DiGraph): the dependency graph
+
+    Returns:
+        reduced (nx.DiGraph): the graph without its superfluous edges
+        superfluous (set): the edges that were removed
+    """
+    if isinstance(graph, CompactGraph):
+        return _compact_reduce(graph)
+    import networkx as nx
+    from networkx.algorithms.dag import transitive_reduction
+    condensed = nx.condensation(graph)
+    kept = transitive_reduction(condensed).edges()
+    mapping = condensed.graph['mapping']
+    reduced = nx.DiGraph()
+    reduced.add_nodes_from(graph.nodes())
+    reduced.add_edges_from([(u, v, data) for u, v, data in graph.edges(data=True)
+            if mapping[u] == mapping[v] or (mapping[u], mapping[v]) in kept])
+    return reduced, graph.edges() - reduced.edges()
+
+def build_reachability_index(graph):
+    """indexes what every node of a graph depends on, directly or not, so that
+    dependency queries don't need the graph or a scan of the project
+
+    The transitive closure is kept on the condensation, as a bitset of the
+    strongly connected components each component can reach.
+
+    Arguments:
+        graph (nx.DiGraph): the dependency graph, or a CompactGraph
+
+    Returns:
+        index (dict): the node names, the component of each node, the graph
+        in compressed sparse row form, and the descendants of each component
+    """
+    compact = graph
+    if not isinstance(graph, CompactGraph):
+        compact = CompactGraph()
+        compact.add_edges_from(graph.edges())
+    offsets, targets = compact._csr()
+    comp, sccs = _compact_sccs(compact)
+    # components come sinks first, so children are done before their parents
+    descendants = [0] * len(sccs)
+    for c, scc in enumerate(sccs):
+        reach = 0
+        for u in scc:
+            for v in targets[offsets[u]:offsets[u+1]]:
+                if comp[v] != c:
+                    reach |= descendants[comp[v]] | (1 << comp[v])
+        descendants[c] = reach
+    return {
+        'names': compact.names,
+        'comp': comp,
+        'offsets': offsets,
+        'targets': targets,
+        'descendants': descendants,
+    }
+
+def index_key(args):
+    """describes the graph the command line arguments ask for, so that a saved
+    index is only used to answer for the same graph of the same files
+
+    Returns:
+        key (dict): the language, parser, root, include search paths,
+        granularity and focus, and a stamp of the path, mtime and size of
+        every file under the root
+    """
+    import hashlib
+    cxx = args.lang in {'c++', 'C++'}
+    files = find_cxx_files(args.root) if cxx else find_py_files(args.root)
+    if cxx and args.compile_commands:
+        files.append(args.compile_commands)
+    stamp = hashlib.sha1()
+    for fl in sorted(files):
+        try:
+            st = os.stat(fl)
+        except OSError:
+            continue
+        stamp.update(f'{fl}\0{st.st_mtime_ns}\0{st.st_size}\n'.encode())
+    return {
+        'lang': 'c++' if cxx else 'python' if args.lang in {'python', 'py'} else args.lang,
+        'parser': None if cxx else args.parser,
+        'root': os.path.abspath(args.root),
+        'include_dirs': [os.path.abspath(include_dir) for include_dir in args.include_dirs] if cxx else [],
+        'compile_commands': os.path.abspath(args.compile_commands) if cxx and args.compile_commands else None,
+        'granularity': args.granularity,
+        'focus': args.focus and os.path.abspath(args.focus),
+        'stamp': stamp.hexdigest(),
+    }
+
+class _BitsetRows:
+    """the descendants of each component of a saved index, read from the
+    file only as queries need them
+
+    Components come sinks first, so row c only has bits below c, and is
+    saved in (c + 7) // 8 bytes.
+    """
+    def __init__(self, buf, start, row_offsets):
+        self.buf = buf
+        self.start = start
+        self.row_offsets = row_offsets
+
+    def __len__(self):
+        return len(self.row_offsets) - 1
+
+    def __getitem__(self, c):
+        begin, end = self.row_offsets[c], self.row_offsets[c+1]
+        return int.from_bytes(self.buf[self.start + begin:self.start + end], 'little')
+
+    def reaching(self, c):
+        """finds the components that reach component c"""
+        buf, start, row_offsets = self.buf, self.start, self.row_offsets
+        byte, bit = c // 8, 1 << (c % 8)
+        return {d for d in range(c + 1, len(self))
+                if row_offsets[d] + byte < row_offsets[d+1] and buf[start + row_offsets[d] + byte] & bit}
+
+def save_index(index, path):
+    """saves a reachability index, replacing the old one atomically
+
+    The file is a line of json with the key and node names, then the arrays
+    and the descendant bitsets in binary, so that load_index can map it and
+    read only the bitsets a query needs. The closure is still quadratic in
+    the number of components, but is never read whole.
+    """
+    rows = [reach.to_bytes(max((c + 7) // 8, (reach.bit_length() + 7) // 8), 'little')
+            for c, reach in enumerate(index['descendants'])]
+    row_offsets = array('q', [0])
+    for row in rows:
+        row_offsets.append(row_offsets[-1] + len(row))
+    header = {
+        'version': INDEX_VERSION,
+        'byteorder': sys.byteorder,
+        'key': index.get('key'),
+        'names': index['names'],
+        'lengths': [len(index['comp']), len(index['offsets']), len(index['targets']), len(row_offsets)],
+    }
+    with open(path + '.tmp', 'wb') as f:
+        f.write(json.dumps(header).encode() + b'\n')
+        array('i', index['comp']).tofile(f)
+        array('q', index['offsets']).tofile(f)
+        array('i', index['targets']).tofile(f)
+        row_offsets.tofile(f)
+        for row in rows:
+            f.write(row)
+    os.replace(path + '.tmp', path)
+
+def load_index(path, key=None):
+    """loads a reachability index saved by save_index
+
+    Arguments:
+        path (str): where the index was saved
+        key (dict): the index_key the index must have been built for
+
+    Returns:
+        index (dict): the index, or None if there is no usable index at path
+    """
+    try:
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        end = buf.find(b'\n')
+        saved = json.loads(buf[:end])
+    except (OSError, ValueError):
+        return None
+    if (saved.get('version') != INDEX_VERSION or saved.get('byteorder') != sys.byteorder
+            or saved.get('key') != key):
+        return None
+    pos = end + 1
+    arrays = []
+    for typecode, length in zip('iqiq', saved['lengths']):
+        arr = array(typecode)
+        arr.frombytes(buf[pos:pos + length * arr.itemsize])
+        arrays.append(arr)
+        pos += length * arr.itemsize
+    comp, offsets, targets, row_offsets = arrays
+    return {
+        'key': key,
+        'names': saved['names'],
+        'comp': comp,
+        'offsets': offsets,
+        'targets': targets,
+        'descendants': _BitsetRows(buf, pos, row_offsets),
+    }
+
+def _find_node(index, node):
+    """finds the id of a node in the index, matching file paths however they
+    are written
+
+    Returns:
+        (int): the id of the node, or None if it isn't in the index
+    """
+    if 'ids' not in index:
+        index['ids'] = {name: i for i, name in enumerate(index['names'])}
+    if node in index['ids']:
+        return index['ids'][node]
+    full = os.path.abspath(node)
+    for i, name in enumerate(index['names']):
+        if os.path.abspath(name) == full:
+            return i
+    return None
+
+def query_index(index, node, reverse=False, depth=None):
+    """answers which nodes a node depends on, or which depend on it
+
+    Arguments:
+        index (dict): the index from build_reachability_index or load_index
+        node (str): the file or module to ask about
+        reverse (bool): find what depends on node, rather than what it depends on
+        depth (int): only follow this many edges, None to follow them all
+
+    Returns:
+        found (list): the names of the nodes found, sorted
+    """
+    start = _find_node(index, node)
+    if start is None:
+        raise KeyError(f"{node} is not in the dependency graph")
+    names, comp, offsets, targets = index['names'], index['comp'], index['offsets'], index['targets']
+
+    if depth is not None:
+        # a breadth first search, but only so deep
+        if reverse:
+            if 'parents' not in index:
+                index['parents'] = [[] for _ in names]
+                for u in range(len(names)):
+                    for v in targets[offsets[u]:offsets[u+1]]:
+                        index['parents'][v].append(u)
+            step = index['parents'].__getitem__
+        else:
+            step = lambda u: targets[offsets[u]:offsets[u+1]]
+        seen = {start}
+        level = [start]
+        for _ in range(depth):
+            following = []
+            for u in level:
+                for v in step(u):
+                    if v not in seen:
+                        seen.add(v)
+                        following.append(v)
+            level = following
+        seen.discard(start)
+        return sorted(names[i] for i in seen)
+
+    # otherwise the closure has the answer
+    c = comp[start]
+    descendants = index['descendants']
+    if reverse and hasattr(descendants, 'reaching'):
+        reached = descendants.reaching(c)
+    elif reverse:
+        reached = {d for d, reach in enumerate(descendants) if (reach >> c) & 1}
+    else:
+        reached = set()
+        reach = descendants[c]
+        while reach:
+            low = reach & -reach
+            reached.add(low.bit_length() - 1)
+            reach ^= low
+    # the rest of a cycle depends on itself
+    reached.add(c)
+    return sorted(names[i] for i in range(len(names)) if comp[i] in reached and i != start)
+
+def _networkx_graph():
+    """makes an empty nx.DiGraph, importing networkx only when one is wanted"""
+    import networkx as nx
+    return nx.DiGraph()
+
+# the kinds of graph that the dependency graph can be built as
+GRAPH_ENGINES = {
+    'networkx': _networkx_graph,
+    'compact': CompactGraph,
+}
+
+def statistics(graph, reduce=True, verb=True, cycle_samples=3, profile=None):
+    """computes the statistics of a dependency graph
+
+    Arguments:
+        graph (nx.DiGraph): the dependency graph, or a CompactGraph
+        reduce (bool): perform a transitive reduction
+        verb (bool): print what was found
+        cycle_samples (int): the most shortest cycles to report per cyclic component
+        profile (dict): if given, the time, peak memory and counts of finding
+            cycles, reducing and finding components are recorded in it
+
+    Returns:
+        stats (dict): the reduced graph, superfluous edges, the cyclic strongly
+        connected components with a sample of their cycles, and the weakly
+        connected components
+    """
     stats = dict()
 
+    # find the strongly connected components, and any cycles in them
+    with _phase(profile, 'cycles') as phase:
+        sccs, cycles = find_cycles(graph, cycle_samples)
+        if phase is not None:
+            phase.update(edges=graph.number_of_edges(), sccs=len(sccs), cycles=len(cycles))
+    if verb:
+        _print_cycles(sccs, cycles)
+    stats['sccs'] = sccs
+    stats['cycles'] = cycles
+
     # perform transitive reduction
     if reduce:
-        from networkx.algorithms.dag import transitive_reduction
-        reduced = transitive_reduction(graph)
+        with _phase(profile, 'reduce') as phase:
+            reduced, superfluous_edges = reduce_graph(graph)
+            if phase is not None:
+                phase.update(edges=reduced.number_of_edges(), superfluous=len(superfluous_edges))
         stats['reduced'] = reduced
 
         # git the extra edges that we honestly don't need
-        superfluous_edges = graph.edges() - reduced.edges()
         stats['superfluous_edges'] = superfluous_edges
         # if verb:
             # print(superfluous_edges)
     else:
         stats['reduced'] = graph
 
-    # find any cycles
-    from networkx.algorithms.cycles import simple_cycles
-    cycles = list(simple_cycles(stats['reduced']))
-    if verb and len(cycles) > 0:
-        print("Found {0} cycles".format(len(cycles)))
-    elif verb:
-        print("Graph is cycle-free")
-    stats['cycles'] = cycles
-
     # calculate connected components
     # from networkx.algorithms.components import connected_components
-    components = list(nx.weakly_connected_components(stats['reduced']))
+    with _phase(profile, 'components') as phase:
+        if isinstance(graph, CompactGraph):
+            components = _compact_components(stats['reduced'])
+        else:
+            from networkx.algorithms.components import weakly_connected_components
+            components = list(weakly_connected_components(stats['reduced']))
+        if phase is not None:
+            phase['components'] = len(components)
     if verb:
-        print("{0} connected component{1}".format(len(components), "" if len(components) == 1 else "s"))
+        _print_components(components)
     stats['components'] = components
 
     # return all the stats we calclulated
     return stats
 
+def _print_cycles(sccs, cycles):
+    if len(sccs) > 0:
+        print("Found cycles in {0} strongly connected component{1}, covering {2} files".format(
+                len(sccs), "" if len(sccs) == 1 else "s", sum(len(scc) for scc in sccs)))
+        for cycle in cycles:
+            print("  " + " -> ".join(cycle + cycle[:1]))
+    else:
+        print("Graph is cycle-free")
+
+def _print_components(components):
+    print("{0} connected component{1}".format(len(components), "" if len(components) == 1 else "s"))
+
+def update_statistics(graph, stats, touched, verb=True, cycle_samples=3):
+    """updates the statistics of a graph after the out-edges of some of its
+    nodes changed, redoing only the work that those changes can affect
+
+    Cycles are only sampled again in components holding a touched node. The
+    reduction is only redone for the touched nodes and what depends on them,
+    since no other node can reach a changed edge. Finding the components
+    themselves takes linear time, so that is done over.
+
+    Arguments:
+        graph (nx.DiGraph): the dependency graph, after the changes
+        stats (dict): the statistics from before the changes, from statistics
+            or update_statistics
+        touched (set): the nodes whose out-edges changed, or which were removed
+        verb (bool): print what was found
+        cycle_samples (int): the most shortest cycles to report per cyclic component
+
+    Returns:
+        stats (dict): the statistics of the changed graph
+    """
+    if isinstance(graph, CompactGraph) or 'superfluous_edges' not in stats:
+        return statistics(graph, verb=verb, cycle_samples=cycle_samples)
+    import networkx as nx
+    from networkx.algorithms.components import weakly_connected_components
+
+    # what can reach a touched node
+    touched = {node for node in touched if node in graph}
+    affected = set(touched)
+    queue = deque(touched)
+    while queue:
+        for pred in graph.predecessors(queue.popleft()):
+            if pred not in affected:
+                affected.add(pred)
+                queue.append(pred)
+
+    # keep the cycles of the components that are just as they were
+    all_sccs = list(nx.strongly_connected_components(graph))
+    old_cycles = dict()
+    for scc in stats['sccs']:
+        old_cycles[frozenset(scc)] = [cycle for cycle in stats['cycles'] if cycle[0] in scc]
+    sccs = []
+    cycles = []
+    for scc in all_sccs:
+        if len(scc) == 1 and not graph.has_edge(*(next(iter(scc)),) * 2):
+            continue
+        sccs.append(scc)
+        if frozenset(scc) in old_cycles and not scc & touched:
+            cycles += old_cycles[frozenset(scc)]
+        else:
+            cycles += _sample_cycles(graph, scc, cycle_samples)
+    if verb:
+        _print_cycles(sccs, cycles)
+
+    # patch the reduction for the affected components
+    condensed = nx.condensation(graph, all_sccs)
+    mapping = condensed.graph['mapping']
+    reduced = stats['reduced']
+    reduced.remove_nodes_from([node for node in reduced if node not in graph])
+    reduced.add_nodes_from(graph.nodes())
+    superfluous = {edge for edge in stats['superfluous_edges'] if edge[0] in graph and edge[0] not in affected}
+    descendants = dict()
+    for c in {mapping[node] for node in affected}:
+        members = condensed.nodes[c]['members']
+        children = {mapping[v] for u in members for v in graph.successors(u)} - {c}
+        reach = set()
+        for child in children:
+            if child not in descendants:
+                descendants[child] = nx.descendants(condensed, child)
+            reach |= descendants[child]
+        for u in members:
+            reduced.remove_edges_from(list(reduced.out_edges(u)))
+            for v in graph.successors(u):
+                if mapping[v] == c or mapping[v] not in reach:
+                    reduced.add_edge(u, v, **graph.edges[u, v])
+                else:
+                    superfluous.add((u, v))
+
+    components = list(weakly_connected_components(reduced))
+    if verb:
+        _print_components(components)
+    return {
+        'sccs': sccs,
+        'cycles': cycles,
+        'reduced': reduced,
+        'superfluous_edges': superfluous,
+        'components': components,
+    }
+
+def build_graph(args, profile=None):
+    """builds the dependency graph that the command line arguments ask for
+
+    Arguments:
+        args (Namespace): the parsed command line arguments
+        profile (dict): if given, the phases of the build are recorded in it
+
+    Returns:
+        graph (nx.DiGraph): the dependency graph, or a CompactGraph
+    """
+    global exclude_list
+    if args.lang in {'c++', 'C++'}:
+        return build_cxx_dependency_graph(args.root, jobs=args.jobs,
+                cache=args.cache or args.cache_hash, cache_hash=args.cache_hash,
+                include_dirs=args.include_dirs, compile_commands=args.compile_commands,
+                engine=args.engine, granularity=args.granularity, focus=args.focus, profile=profile)
+    elif args.lang in {'python', 'py'}:
+        exclude_list = PY_EXCLUDES
+        return build_py_dependency_graph(args.root, jobs=args.jobs,
+                cache=args.cache or args.cache_hash, cache_hash=args.cache_hash,
+                parser=args.parser, engine=args.engine, granularity=args.granularity, focus=args.focus,
+                profile=profile)
+    raise ValueError(f"Unsupported language: {args.lang}")
+
+def write_output(graph, args):
+    """writes the graph where and how the command line asks, replacing any
+    old output atomically so readers never see half a graph
+
+    Returns:
+        out (str): the file written
+    """
+    writer, ext = WRITERS[args.format]
+    out = args.out or f'dependencies.{ext}'
+    if args.gzip and not out.endswith('.gz'):
+        out += '.gz'
+    # keep the extension at the end of the temporary name, for gzip
+    head, tail = os.path.split(out)
+    tmp = os.path.join(head, '.tmp.' + tail)
+    writer(graph, tmp)
+    os.replace(tmp, out)
+    return out
+
+def print_profile(profile):
+    """prints where a run spent its time and memory, phase by phase, and the
+    files that were slowest to scan
+
+    Arguments:
+        profile (dict): the profile recorded by the builders and statistics
+    """
+    print(f"{'phase':<12}{'seconds':>10}{'files/s':>12}{'MB read':>10}{'MB written':>12}{'edges':>10}{'peak MB':>10}")
+    for name, phase in profile['phases'].items():
+        files = phase.get('scanned', phase.get('files'))
+        rate = f"{files / phase['seconds']:.0f}" if files and phase['seconds'] else '-'
+        read = f"{phase['bytes'] / 2**20:.1f}" if 'bytes' in phase else '-'
+        written = f"{phase['bytes_written'] / 2**20:.1f}" if 'bytes_written' in phase else '-'
+        peak = f"{phase['peak_rss_kb'] / 1024:.1f}" if phase.get('peak_rss_kb') else '-'
+        print(f"{name:<12}{phase['seconds']:>10.3f}{rate:>12}{read:>10}{written:>12}{phase.get('edges', '-'):>10}{peak:>10}")
+    print(f"{'total':<12}{sum(phase['seconds'] for phase in profile['phases'].values()):>10.3f}")
+    slowest = profile['phases'].get('parse', dict()).get('slowest')
+    if slowest:
+        print('slowest files:')
+        for entry in slowest:
+            print(f"\t{entry['seconds'] * 1000:8.2f} ms {entry['bytes']:>10} B  {entry['file']}")
+
+def watch(args):
+    """keeps the dependency graph up to date as the project changes
+
+    The tree is polled for changed mtimes and sizes. Only new and changed files
+    are parsed again, and their edges are patched into the graph, then the
+    statistics are updated and the output rewritten. Resolution is redone for
+    every file when files come or go, since that can change what the other
+    files' imports resolve to.
+
+    Arguments:
+        args (Namespace): the parsed command line arguments
+    """
+    global exclude_list
+    root = args.root
+    if args.lang in {'c++', 'C++'}:
+        include_dirs = [os.path.abspath(include_dir) for include_dir in args.include_dirs]
+        if args.compile_commands:
+            include_dirs += [include_dir for include_dir in read_compile_commands(args.compile_commands)
+                    if include_dir not in include_dirs]
+        include_dirs = tuple(include_dirs)
+        find_files, scan, build_index = find_cxx_files, _scan_cxx_file, build_cxx_include_index
+        resolve = lambda fl, found, index: _resolve_cxx_includes(fl, found, index, include_dirs)
+    else:
+        exclude_list = PY_EXCLUDES
+        find_files, scan, build_index = find_py_files, PY_SCANNERS[args.parser], build_py_module_index
+        resolve = lambda fl, found, index: _resolve_py_imports(fl, found, index, root)
+
+    graph = GRAPH_ENGINES[args.engine]()
+    stamps = dict()
+    found = dict()
+    edges = dict()
+    index = None
+    stats = None
+    print(f'watching {root}...')
+    while True:
+        files = find_files(root)
+        new_stamps = dict()
+        for fl in files:
+            try:
+                st = os.stat(fl)
+            except OSError:
+                # gone since the glob, catch it next time
+                continue
+            new_stamps[fl] = (st.st_mtime_ns, st.st_size)
+        files = list(new_stamps)
+        changed = [fl for fl in files if stamps.get(fl) != new_stamps[fl]]
+        removed = [fl for fl in stamps if fl not in new_stamps]
+        stamps = new_stamps
+
+        if changed or removed:
+            start = time.perf_counter()
+            scanned = _map_files(functools.partial(_try_scan, scan), changed, args.jobs)
+            for fl, result in zip(changed, scanned):
+                if result is None:
+                    # gone since the stat, so forget it until a later check
+                    # sees it again
+                    del stamps[fl]
+                    if fl in found:
+                        removed.append(fl)
+                else:
+                    found[fl] = result
+            changed = [fl for fl in changed if fl in stamps]
+            files = list(stamps)
+            for fl in removed:
+                del found[fl]
+
+            # new or deleted files can change what everything resolves to
+            if removed or any(fl not in edges for fl in changed):
+                index = build_index(files)
+                to_resolve = files
+            else:
+                to_resolve = changed
+
+            touched = set(removed)
+            stale = []
+            for fl in to_resolve:
+                new = [edge for edge in resolve(fl, found[fl], index)
+                        if not edge[0] in exclude_list and not edge[1] in exclude_list]
+                if new != edges.get(fl):
+                    stale += edges.get(fl, [])
+                    edges[fl] = new
+                    touched.add(fl)
+            for fl in removed:
+                stale += edges.pop(fl, [])
+
+            groups = make_grouping(root, files, args.granularity, args.focus)
+            if groups is not None:
+                # collapsed graphs are small, so recount them from scratch
+                graph = GRAPH_ENGINES[args.engine]()
+                weights = Counter()
+                for fl in files:
+                    _group_edges(edges[fl], groups, weights)
+                _add_weighted_edges(graph, weights)
+                stats = None
+            elif isinstance(graph, CompactGraph):
+                # compact graphs can't be patched, but they are quick to build
+                graph = CompactGraph()
+                for fl in files:
+                    graph.add_edges_from(edges[fl])
+            else:
+                graph.remove_edges_from(stale)
+                for fl in touched:
+                    if fl in edges:
+                        graph.add_edges_from(edges[fl])
+                # drop the nodes that nothing points at any more
+                graph.remove_nodes_from([node for edge in stale for node in edge
+                        if node in graph and graph.degree(node) == 0])
+
+            if stats is None:
+                stats = statistics(graph, cycle_samples=args.cycles)
+            else:
+                stats = update_statistics(graph, stats, touched, cycle_samples=args.cycles)
+            out = write_output(stats['reduced'], args)
+            print(f"{len(changed)} changed, {len(removed)} removed, "
+                    f"updated {out} in {time.perf_counter() - start:.2f}s")
+        time.sleep(args.interval)
+
 if __name__ == "__main__":
     parser = ap.ArgumentParser('graph_deps',description="""graph_deps analyzes a
             project and builds the dependency graph of the project by language""")
@@ -215,28 +1940,112 @@ if __name__ == "__main__":
             type=str, help="the language of the project to analyze")
     parser.add_argument('root', action='store', nargs='?', type=str,
             default='.', help='the root of the directory to analyze')
+    parser.add_argument('-j', '--jobs', action='store', dest='jobs', default=1,
+            type=int, help="the number of processes to scan files with, 0 for one per cpu")
+    parser.add_argument('-p', '--parser', action='store', dest='parser', default='regex',
+            choices=tuple(PY_SCANNERS), help="how to find python imports: a line regex, or a parse of each file")
+    parser.add_argument('-I', '--include', action='append', dest='include_dirs', default=[], metavar='DIR',
+            type=str, help="a c++ include search path, may be given more than once")
+    parser.add_argument('--compile-commands', action='store', dest='compile_commands', default=None, metavar='PATH',
+            type=str, help="a compile_commands.json to read c++ include search paths from")
+    parser.add_argument('--cache', action='store_true', dest='cache',
+            help=f"reuse scans of unchanged files, kept in {CACHE_NAME} under the root")
+    parser.add_argument('--cache-hash', action='store_true', dest='cache_hash',
+            help="with --cache, detect changed files by content hash rather than mtime and size")
+    parser.add_argument('-e', '--engine', action='store', dest='engine', default='networkx',
+            choices=tuple(GRAPH_ENGINES), help="the graph to build: networkx, or a compact one for very large projects")
+    parser.add_argument('-f', '--format', action='store', dest='format', default='dot',
+            choices=tuple(WRITERS), help="the format to write the graph in")
+    parser.add_argument('-o', '--out', action='store', dest='out', default=None,
+            type=str, help="the file to write the graph to, gzipped if it ends in .gz")
+    parser.add_argument('-z', '--gzip', action='store_true', dest='gzip',
+            help="gzip the graph, adding .gz to the output file")
+    parser.add_argument('--deps', action='store', dest='deps', default=None, metavar='PATH',
+            type=str, help="list what the given file or module depends on, then exit")
+    parser.add_argument('--rdeps', action='store', dest='rdeps', default=None, metavar='PATH',
+            type=str, help="list what depends on the given file or module, then exit")
+    parser.add_argument('--depth', action='store', dest='depth', default=None,
+            type=int, help="with --deps or --rdeps, only follow this many imports")
+    parser.add_argument('--index', action='store_true', dest='index',
+            help=f"save the index that --deps and --rdeps use, in {INDEX_NAME} under the root")
+    parser.add_argument('--reindex', action='store_true', dest='reindex',
+            help="with --deps or --rdeps, rebuild the index rather than use the saved one")
+    parser.add_argument('-w', '--watch', action='store_true', dest='watch',
+            help="keep running, and update the graph whenever files change")
+    parser.add_argument('--interval', action='store', dest='interval', default=1.0,
+            type=float, help="with --watch, the seconds between checks for changes")
+    parser.add_argument('--cycles', action='store', dest='cycles', default=3,
+            type=int, help="the most shortest cycles to report for each strongly connected component")
+    parser.add_argument('-g', '--granularity', action='store', dest='granularity', default='file',
+            type=parse_granularity, metavar='{file,package,dir:N}',
+            help="collapse files into their package, or their first N directories, weighting edges by imports")
+    parser.add_argument('--focus', action='store', dest='focus', default=None, metavar='DIR',
+            type=str, help="with --granularity, keep the files under this directory apart, to drill down into it")
+    parser.add_argument('--profile', action='store_true', dest='profile',
+            help="report the time, memory and work of each phase of the run")
+    parser.add_argument('--profile-json', action='store', dest='profile_json', default=None, metavar='PATH',
+            type=str, help="write the profile of each phase to a json file")
+    parser.add_argument('--cprofile', action='store', dest='cprofile', default=None, metavar='PATH',
+            type=str, help="dump cProfile stats of the run to a file, for pstats or snakeviz")
 
     args = parser.parse_args()
+    if args.watch and (args.deps or args.rdeps):
+        parser.error("argument -w/--watch: not allowed with --deps or --rdeps")
 
-    print('analyzing...')
-    global pattern
-    if args.lang in {'c++', 'C++'}:
-        G = build_cxx_dependency_graph(args.root)
-        reduce=True
-    elif args.lang in {'python', 'py'}:
-        exclude_list = {'os','sys','pickle','json','socket',
-        'functools','cvxopt','signal','PIL','traceback','pandas',
-        'numpy','_thread','threading','inspect','io','flask',
-        'flask_cas','matplotlib','Cryptodome','pytest','psutil',
-        'docker','git','argparse','subprocess','random','time',
-        'glob','importlib','shutil','collections','logging', 'requests',
-        'matplotlib.pyplot','builtins','uuid', 'sqlalchemy', 'flask_login',
-        'queue','socketserver','select','struct','urllib','webbrowser'}
-        G = build_py_dependency_graph(args.root)
-        reduce=True
-    
-    reduced = statistics(G, reduce=reduce)['reduced']
-    # visualize(reduced)
-    out = 'dependencies.gv'
-    write_gv(reduced, out)
-    print(f"Graphviz file written to {out}")
+    profile = dict() if args.profile or args.profile_json else None
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        # answer queries from the saved index when there is one
+        querying = args.deps or args.rdeps
+        index_path = os.path.join(args.root, INDEX_NAME)
+        key = index_key(args) if querying or args.index else None
+        index = load_index(index_path, key) if querying and not args.reindex else None
+
+        if index is None and not args.watch:
+            if not querying:
+                print('analyzing...')
+            G = build_graph(args, profile)
+            if querying or args.index:
+                index = build_reachability_index(G)
+                index['key'] = key
+                save_index(index, index_path)
+
+        if querying:
+            try:
+                found = query_index(index, args.deps or args.rdeps, reverse=bool(args.rdeps), depth=args.depth)
+            except KeyError as e:
+                print(e.args[0])
+                sys.exit(1)
+            for name in found:
+                print(name)
+            sys.exit(0)
+
+        if args.watch:
+            try:
+                watch(args)
+            except KeyboardInterrupt:
+                pass
+            sys.exit(0)
+
+        reduced = statistics(G, reduce=True, cycle_samples=args.cycles, profile=profile)['reduced']
+        # visualize(reduced)
+        with _phase(profile, 'write') as phase:
+            out = write_output(reduced, args)
+            if phase is not None:
+                phase.update(edges=reduced.number_of_edges(), bytes_written=os.path.getsize(out))
+        print(f"{'Graphviz' if args.format == 'dot' else args.format} file written to {out}")
+
+        if args.profile:
+            print_profile(profile)
+        if args.profile_json:
+            with open(args.profile_json, 'w') as f:
+                json.dump(profile, f, indent=2)
+    finally:
+        # queries and --watch exit early, but still want their profile
+        if args.cprofile:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
@@ -19,55 +19,689 @@ argument. For example, passing 4d20d will roll 4 pairs
 of 20-sided dice, and for each pair will return the lesser
 of the two numbers rolled.
 
+Rolls can also be whole expressions, like '4d6kh3+2', in
+quotes if they have spaces. They add, subtract, multiply
+and divide (rounding down) dice and numbers, with brackets,
+and any dice can be followed by
+    khN or kN  to keep the N highest dice, klN the N lowest
+    dhN, dlN   to drop the N highest or lowest dice
+    !          to roll another die whenever one rolls its
+               highest, or !>N whenever one rolls over N
+    rN, r<N    to reroll dice that roll N, or under N,
+               until they don't, or roN to reroll once
+'d%' is a 100-sided die.
+
+Huge rolls are quicker with '--engine numpy', which rolls
+the dice in batches with numpy, if it is installed.
+
+Pass '--dist' to get the exact distribution of the total of
+the rolls instead of rolling them, and '--table' to list the
+chance of every total. This also needs numpy.
+
+Pass '--trials N' to roll the lot N times and print the
+statistics of the grand totals, over '--jobs' processes.
+Give '--seed' to get the same rolls every time, whatever
+the number of processes.
+
+Pass '--summary' to print the statistics and a histogram of
+the dice rolled instead of every die, which rolls any number
+of dice in the same memory.
+
+To roll many times without starting up each time, pass
+'--batch' to read one roll per line from stdin, or
+'--serve ADDRESS' to take them over a unix socket, or a
+[host:]port on this machine. Each roll is answered with a
+line of json. The server refuses rolls of over a million
+dice, or of more than '--max-dice'.
+
 Eric Steadman - 2020
 """
 
+import argparse as ap
+import functools
+import itertools
+import json
+import operator
+import os
 import re
 import sys
 import random
+from collections import Counter
 from math import floor
 
-def roll_x_y_sided_dice(x,y):
+# the ways to roll dice; numpy is imported only when it is used
+ENGINES = ('python', 'numpy')
+
+# the most dice the numpy engine rolls at once, which bounds its scratch memory
+CHUNK_SIZE = 1 << 20
+
+# dice with this many sides or more are always rolled in python, where the
+# totals can't overflow
+NUMPY_MAX_SIDES = 1 << 32
+
+# distributions longer than this are convolved by fft rather than directly
+FFT_THRESHOLD = 512
+
+# trials are rolled in blocks of this many, each with its own random stream,
+# so that the rolls don't depend on how the blocks are shared out
+TRIAL_BLOCK = 1 << 16
+
+# the most extra dice one exploding die can add, so that d1! stops
+EXPLODE_LIMIT = 100
+
+# the tokens of dice expressions, with the longer of overlapping ones first
+_token_pattern = re.compile(r'\s*(\d+|kh|kl|dh|dl|ro|[-+*/()%dkar!<>=])')
+
+# the comparisons that exploding and rerolling dice can use
+_COMPARISONS = {
+    '=': operator.eq,
+    '<': operator.lt,
+    '>': operator.gt,
+}
+
+# the arithmetic of dice expressions, which rounds down when it divides
+_OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.floordiv,
+}
+
+# the most bins in the histograms of --summary
+SUMMARY_BINS = 20
+
+# the percentiles --dist and --trials report
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# the most dice --serve rolls for one roll, since rolls take turns and one
+# huge roll would hold up every other client
+SERVE_MAX_DICE = 10**6
+
+def roll_x_y_sided_dice(x,y,rng=random):
     """Rolls x, y-sided dice
 
     Parameters:
         x (int): the number of dice to roll
         y (int): the number of sides on each die
+        rng (random.Random): the generator to roll with, the global one by default
     
     Returns:
         rolls (list): the value of each roll
     """
-    return [floor(random.random()*y)+1 for _ in range(x)]
+    return [floor(rng.random()*y)+1 for _ in range(x)]
+
+def roll_x_y_sided_dice_numpy(x, y, keep=None, rng=None):
+    """Rolls x, y-sided dice with numpy, a chunk at a time, keeping the
+    greater or lesser of a pair of dice for each roll if asked
+
+    Parameters:
+        x (int): the number of dice to roll
+        y (int): the number of sides on each die
+        keep (str): None, 'a' to keep the greater of each pair, or 'd' to
+            keep the lesser
+        rng (np.random.Generator): the generator to roll with, a fresh one
+            by default
+
+    Returns:
+        rolls (np.ndarray): the value of each roll, in the smallest unsigned
+            type that holds y
+    """
+    import numpy as np
+    if rng is None:
+        rng = np.random.default_rng()
+    dtype = np.min_scalar_type(y)
+    rolls = np.empty(x, dtype=dtype)
+    for start in range(0, x, CHUNK_SIZE):
+        chunk = rolls[start:start + CHUNK_SIZE]
+        if keep is None:
+            chunk[:] = rng.integers(1, y, size=len(chunk), dtype=dtype, endpoint=True)
+        else:
+            # one row per pair, then keep the greater or lesser of each row
+            pairs = rng.integers(1, y, size=(len(chunk), 2), dtype=dtype, endpoint=True)
+            if keep == 'a':
+                pairs.max(axis=1, out=chunk)
+            else:
+                pairs.min(axis=1, out=chunk)
+    return rolls
+
+def _kth_smallest(values, k):
+    """finds the kth smallest of the values, counting from 0, by partitioning
+    around a pivot, which takes linear time on average rather than a sort
+    """
+    while True:
+        pivot = values[len(values) // 2]
+        lows = [v for v in values if v < pivot]
+        highs = [v for v in values if v > pivot]
+        if k < len(lows):
+            values = lows
+        elif k < len(values) - len(highs):
+            return pivot
+        else:
+            k -= len(values) - len(highs)
+            values = highs
+
+def keep_dice(values, n, highest=True):
+    """keeps the n highest or lowest of the dice rolled, without sorting them
+
+    Parameters:
+        values (list): the dice rolled
+        n (int): the number of dice to keep
+        highest (bool): keep the highest dice, or else the lowest
+
+    Returns:
+        kept (list): the dice kept, in the order they were rolled
+    """
+    if n >= len(values):
+        return list(values)
+    if n <= 0:
+        return []
+    cut = _kth_smallest(values, len(values) - n if highest else n - 1)
+    # keep everything past the cut, and as many at the cut as it takes
+    spare = n - sum(1 for v in values if v != cut and (v > cut) == highest)
+    kept = []
+    for v in values:
+        if v != cut:
+            if (v > cut) == highest:
+                kept.append(v)
+        elif spare:
+            kept.append(v)
+            spare -= 1
+    return kept
+
+def _keep_counts(counts, n, highest=True):
+    """keeps the n highest or lowest dice, as keep_dice does, from the number
+    of times each face came up rather than the dice themselves
+
+    Returns:
+        kept (Counter): the number of each face kept
+    """
+    kept = Counter()
+    for face in sorted(counts, reverse=highest):
+        if n <= 0:
+            break
+        kept[face] = min(counts[face], n)
+        n -= kept[face]
+    return kept
+
+class Summary:
+    """running statistics of the dice rolled, which take the same memory
+    however many dice there are
+
+    Attributes:
+        count (int): the number of dice
+        total (int): the sum of the dice
+        mean (float): the mean of the dice, kept by Welford's method
+        m2 (float): the sum of the squared differences from the mean
+        min (int): the lowest die, or None before any dice
+        max (int): the highest die, or None before any dice
+        width (int): the faces each bin of the histogram covers
+        hist (list): the number of dice in each bin, from face 1 up
+    """
+
+    def __init__(self, sides):
+        """
+        Parameters:
+            sides (int): the most sides of any die to be summarized
+        """
+        sides = max(sides, 1)
+        self.width = -(-sides // min(sides, SUMMARY_BINS))
+        self.hist = [0] * -(-sides // self.width)
+        self.count = 0
+        self.total = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def _merge(self, count, total, mean, m2, low, high):
+        """merges the statistics of a batch of dice in, by Chan's method"""
+        n = self.count + count
+        delta = mean - self.mean
+        self.m2 += m2 + delta * delta * self.count * count / n
+        self.mean += delta * count / n
+        self.count = n
+        self.total += total
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def add(self, face, times=1):
+        """adds a die, or times dice with the same face"""
+        self._merge(times, face * times, float(face), 0.0, face, face)
+        self.hist[(face - 1) // self.width] += times
+
+    def add_counts(self, counts):
+        """adds the dice counted by face
+
+        Returns:
+            total (int): the sum of the dice added
+        """
+        total = self.total
+        for face, times in counts.items():
+            if times:
+                self.add(face, times)
+        return self.total - total
+
+    def add_array(self, dice):
+        """adds a numpy array of dice
+
+        Returns:
+            total (int): the sum of the dice added
+        """
+        import numpy as np
+        if not len(dice):
+            return 0
+        total = int(dice.sum(dtype='i8'))
+        mean = total / len(dice)
+        m2 = float(np.square(dice - mean).sum())
+        self._merge(len(dice), total, mean, m2, int(dice.min()), int(dice.max()))
+        for i, n in enumerate(np.bincount((dice - 1) // self.width, minlength=len(self.hist)).tolist()):
+            self.hist[i] += n
+        return total
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else 0.0
+
+class Expression:
+    """a dice expression compiled by compile_expression
+
+    Attributes:
+        source (str): the expression as it was written
+        terms (list): a (sign, (x, y, keep)) tuple for each dice term, in the
+            form do_rolls takes, if the expression only adds and subtracts
+            plain, advantage and disadvantage dice and numbers. Otherwise None.
+        constant (int): the number added to the terms, or None
+        sides (int): the most sides of any of its dice
+        count (int): the number of dice it rolls, before any explode or are
+            rerolled, so only a lower bound when some can
+        max_dice (int): the most dice it can roll, counting every die that
+            explodes and every reroll. Rerolling until a die doesn't match
+            has no limit, so those dice count the rolls they take on average.
+    """
+
+    def __init__(self, source, evaluate, linear, sides=0, count=0, max_dice=None):
+        self.source = source
+        self._evaluate = evaluate
+        self.terms, self.constant = linear if linear else (None, None)
+        self.sides = sides
+        self.count = count
+        self.max_dice = count if max_dice is None else max_dice
+
+    def roll(self, rng=random):
+        """rolls the expression once
+
+        Parameters:
+            rng (random.Random): the generator to roll with
+
+        Returns:
+            total (int): what the expression came to
+            dice (list): the dice kept by each dice term, in order
+        """
+        dice = []
+        return self._evaluate(rng, dice), dice
+
+    def summarize(self, summary, rng=random):
+        """rolls the expression once, streaming the dice kept into a summary
+        rather than keeping them
+
+        Parameters:
+            summary (Summary): the summary to add the dice kept to
+            rng (random.Random): the generator to roll with
+
+        Returns:
+            total (int): what the expression came to
+        """
+        return self._evaluate(rng, summary)
+
+    def __reduce__(self):
+        # closures don't pickle, so worker processes compile the source again
+        return compile_expression, (self.source,)
+
+    def __repr__(self):
+        return f'compile_expression({self.source!r})'
+
+def _constant(n):
+    """builds the closure and linear form of a number"""
+    return (lambda rng, dice: n), ([], n)
+
+def _negate(operand):
+    """builds the closure and linear form of a negation"""
+    evaluate, linear = operand
+    return ((lambda rng, dice: -evaluate(rng, dice)),
+            linear and ([(-sign, term) for sign, term in linear[0]], -linear[1]))
+
+def _binary(op, left, right):
+    """builds the closure and linear form of some arithmetic, evaluating the
+    left side first so dice are rolled in the order they are written
+    """
+    (evaluate_left, linear_left), (evaluate_right, linear_right) = left, right
+    func = _OPERATORS[op]
+    if op == '/' and linear_right and not linear_right[0] and not linear_right[1]:
+        raise ValueError("division by zero")
+    linear = None
+    if linear_left and linear_right:
+        if op in '+-':
+            sign = 1 if op == '+' else -1
+            linear = (linear_left[0] + [(sign * s, term) for s, term in linear_right[0]],
+                    linear_left[1] + sign * linear_right[1])
+        elif not linear_left[0] and not linear_right[0]:
+            # fold arithmetic on numbers alone
+            return _constant(func(linear_left[1], linear_right[1]))
+    return (lambda rng, dice: func(evaluate_left(rng, dice), evaluate_right(rng, dice))), linear
+
+def _rerolled_faces(matches, sides):
+    """counts the faces of a die that a reroll matches. Comparisons match a
+    run of faces at the low or high end of the die, or else one face.
+    """
+    low = matches(1)
+    if not low and not matches(sides):
+        # only dice with a middle face can match just one
+        return 1 if sides > 2 else 0
+    # binary search for the last face of the run
+    lo, hi = 1, sides
+    while lo < hi:
+        mid = (lo + hi + (1 if low else 0)) // 2
+        if matches(mid) == low:
+            lo, hi = (mid, hi) if low else (mid + 1, hi)
+        else:
+            lo, hi = (lo, mid - 1) if low else (lo, mid)
+    return lo if low else sides - lo + 1
+
+def _dice_term(count, sides, keep=None, select=None, explode=None, reroll=None):
+    """builds the closure and linear form of a dice term
+
+    Parameters:
+        count (int): the number of dice to roll
+        sides (int): the number of sides on each die
+        keep (str): None, 'a' for advantage, or 'd' for disadvantage
+        select (tuple): None, or the kind of selection, 'kh', 'kl', 'dh' or
+            'dl', and the number of dice it keeps or drops
+        explode (callable): None, or whether a die rolls another
+        reroll (tuple): None, or whether a die is rerolled, and whether only once
+
+    The closure appends the dice it keeps to a list, or else streams them
+    into a Summary, counting the faces rolled a chunk at a time.
+    """
+    def summarize(rng, summary):
+        rolled = roll_each(rng)
+        if select:
+            # only the number of each face rolled is needed to choose dice
+            counts = Counter(rolled)
+            kind, n = select
+            if kind[0] == 'd':
+                n, kind = sum(counts.values()) - n, 'kl' if kind == 'dh' else 'kh'
+            return summary.add_counts(_keep_counts(counts, n, kind == 'kh'))
+        total = 0
+        while True:
+            counts = Counter(itertools.islice(rolled, CHUNK_SIZE))
+            if not counts:
+                return total
+            total += summary.add_counts(counts)
+
+    def face(rng):
+        v = floor(rng.random()*sides)+1
+        if reroll:
+            matches, once = reroll
+            while matches(v):
+                v = floor(rng.random()*sides)+1
+                if once:
+                    break
+        return v
+
+    def die(rng):
+        if keep is None:
+            return face(rng)
+        pair = (face(rng), face(rng))
+        return max(pair) if keep == 'a' else min(pair)
+
+    def roll_each(rng):
+        if not (keep or explode or reroll):
+            # the common case, without a call per die
+            uniform = rng.random
+            yield from (floor(uniform()*sides)+1 for _ in range(count))
+            return
+        for _ in range(count):
+            v = die(rng)
+            yield v
+            extra = 0
+            while explode and explode(v) and extra < EXPLODE_LIMIT:
+                v = die(rng)
+                yield v
+                extra += 1
+
+    if not (select or explode or reroll):
+        linear = ([(1, (count, sides, keep))], 0)
+        if keep is None:
+            def evaluate(rng, dice):
+                if isinstance(dice, Summary):
+                    return summarize(rng, dice)
+                rolled = roll_x_y_sided_dice(count, sides, rng)
+                dice.append(rolled)
+                return sum(rolled)
+            return evaluate, linear
+    else:
+        linear = None
+
+    def evaluate(rng, dice):
+        if isinstance(dice, Summary):
+            return summarize(rng, dice)
+        pool = list(roll_each(rng))
+        if select:
+            kind, n = select
+            if kind[0] == 'd':
+                # dropping the highest is keeping the rest of the lowest
+                n, kind = len(pool) - n, 'kl' if kind == 'dh' else 'kh'
+            pool = keep_dice(pool, n, kind == 'kh')
+        dice.append(pool)
+        return sum(pool)
+    return evaluate, linear
+
+@functools.lru_cache(maxsize=1024)
+def compile_expression(source):
+    """compiles a dice expression, like '4d6kh3+2', into a tree of closures
+    which can be rolled over and over. Each source is only compiled once.
+
+    Expressions add, subtract, multiply and divide, rounding down, numbers
+    and dice terms, with brackets. A dice term is [count]d<sides or %>
+    followed by any of a, d, khN, kN, klN, dhN, dlN, !, !<op>N, r<op>N and
+    ro<op>N, where <op> is =, < or >, and may be left out for =.
+
+    Parameters:
+        source (str): the expression
+
+    Returns:
+        expression (Expression): the compiled expression
+
+    Raises:
+        ValueError: if the source isn't a dice expression
+    """
+    tokens = []
+    text = source.rstrip()
+    pos = 0
+    while pos < len(text):
+        match = _token_pattern.match(text, pos)
+        if not match:
+            raise ValueError(f"unexpected {text[pos:].lstrip()[0]!r}")
+        tokens.append(match.group(1))
+        pos = match.end()
+    tokens.append(None)
+    at = 0
+    most_sides = 0
+    dice_count = 0
+    max_dice = 0
+
+    def peek():
+        return tokens[at]
+
+    def take():
+        nonlocal at
+        at += 1
+        return tokens[at - 1]
+
+    def number(default=None):
+        if peek() is not None and peek().isdigit():
+            return int(take())
+        if default is None:
+            raise ValueError(f"expected a number, not {repr(peek()) if peek() else 'the end'}")
+        return default
+
+    def comparison(default=None):
+        op = take() if peek() in _COMPARISONS else '='
+        n = number(default if op == '=' else None)
+        return functools.partial(lambda compare, n, v: compare(v, n), _COMPARISONS[op], n)
+
+    def dice(count):
+        nonlocal most_sides, dice_count, max_dice
+        sides = 100 if peek() == '%' and take() else number()
+        if sides < 1:
+            raise ValueError("dice need at least one side")
+        most_sides = max(most_sides, sides)
+        options = dict()
+        while peek() in {'a', 'd', 'k', 'kh', 'kl', 'dh', 'dl', '!', 'r', 'ro'}:
+            mod = take()
+            if mod in {'a', 'd'}:
+                options['keep'] = mod
+            elif mod == '!':
+                options['explode'] = comparison(sides)
+            elif mod in {'r', 'ro'}:
+                matches = comparison()
+                # a die that always rerolls would never stop
+                if matches(1) and matches(sides):
+                    raise ValueError(f"every roll of a d{sides} would be rerolled")
+                options['reroll'] = (matches, mod == 'ro')
+            else:
+                options['select'] = ('kh' if mod == 'k' else mod, number(1))
+        per_die = 2 if options.get('keep') else 1
+        dice_count += count * per_die
+        if 'reroll' in options:
+            matches, once = options['reroll']
+            per_die *= 2 if once else -(-sides // (sides - _rerolled_faces(matches, sides)))
+        if 'explode' in options:
+            per_die *= EXPLODE_LIMIT + 1
+        max_dice += count * per_die
+        return _dice_term(count, sides, **options)
+
+    def atom():
+        token = take()
+        if token == '(':
+            inner = expression()
+            if take() != ')':
+                raise ValueError("expected ')'")
+            return inner
+        if token == '-':
+            return _negate(atom())
+        if token == 'd':
+            return dice(1)
+        if token is not None and token.isdigit():
+            if peek() == 'd':
+                take()
+                return dice(int(token))
+            return _constant(int(token))
+        raise ValueError(f"unexpected {repr(token) if token else 'end'}")
+
+    def term():
+        left = atom()
+        while peek() in {'*', '/'}:
+            op = take()
+            left = _binary(op, left, atom())
+        return left
+
+    def expression():
+        left = term()
+        while peek() in {'+', '-'}:
+            op = take()
+            left = _binary(op, left, term())
+        return left
+
+    evaluate, linear = expression()
+    if peek() is not None:
+        raise ValueError(f"unexpected {peek()!r}")
+    return Expression(source, evaluate, linear, most_sides, dice_count, max_dice)
+
+def _linear(rolls):
+    """flattens rolls into their dice terms and a number added to them
+
+    Parameters:
+        rolls (list): rolls in the form do_rolls takes
+
+    Returns:
+        terms (list): a (sign, (x, y, keep)) tuple for each dice term
+        constant (int): the number added to the terms
+        or None if some roll does more than add and subtract dice
+    """
+    terms, constant = [], 0
+    for roll in rolls:
+        if isinstance(roll, Expression):
+            if roll.terms is None:
+                return None
+            terms += roll.terms
+            constant += roll.constant
+        else:
+            terms.append((1, (int(roll[0]), int(roll[1]), roll[2])))
+    return terms, constant
 
-def do_rolls(rolls):
+def do_rolls(rolls, engine='python', rng=None):
     """accepts a list of 3 tuples, where the first is the number of dice
     to roll, the second is the number of sides on the die, and the third
     is either None, 'a' signifying advantage, or 'd' signifying
-    disadvantage
+    disadvantage. Expressions from compile_expression can be given in place
+    of tuples, and then the numbers rolled are a list of the dice each of
+    their dice terms kept.
 
     Parameters:
         rolls (list): the list of rolls to do
+        engine (str): 'python', or 'numpy' to roll in numpy arrays
+        rng: the generator to roll with, from make_rng, or None for a fresh
+            or global one
 
     Returns:
         results (list): a list of 2 tuples containing the numbers rolled
-            and the total
+            and the total. With the numpy engine the numbers rolled are a
+            numpy array.
         total (int): the total for all the rolls
     """
     # result variables
     results = []
     total = 0
+    if rng is None:
+        rng = make_rng(engine)
+    # numpy can't roll the biggest dice, so those fall back on python
+    py_rng = rng if engine == 'python' else random
     # for each roll we need to do
     for roll in rolls:
+        if isinstance(roll, Expression):
+            if engine == 'numpy' and roll.terms is not None and all(
+                    term[1] < NUMPY_MAX_SIDES for _, term in roll.terms):
+                result, s = [], roll.constant
+                for sign, term in roll.terms:
+                    rolled = roll_x_y_sided_dice_numpy(*term, rng)
+                    result.append(rolled)
+                    s += sign * int(rolled.sum(dtype='u8'))
+            else:
+                if py_rng is random and engine == 'numpy':
+                    # draw a python generator from numpy's, so seeds still hold
+                    py_rng = random.Random(int(rng.integers(1 << 63)))
+                s, result = roll.roll(py_rng)
+            total += s
+            results.append((result,s))
+            continue
+        if engine == 'numpy' and int(roll[1]) < NUMPY_MAX_SIDES:
+            result = roll_x_y_sided_dice_numpy(int(roll[0]), int(roll[1]), roll[2], rng)
+            # sum wide, then back to a python int like the python engine's
+            s = int(result.sum(dtype='u8'))
+            total += s
+            results.append((result,s))
+            continue
         # if it's advantace, handle that
         if roll[2] == 'a':
             # take the max of 2 y-sided dice x times
-            result = [max(roll_x_y_sided_dice(2,int(roll[1]))) for _ in range(int(roll[0]))]
+            result = [max(roll_x_y_sided_dice(2,int(roll[1]),py_rng)) for _ in range(int(roll[0]))]
         elif roll[2] == 'd':
             # take the min of 2 y-sided dice x times
-            result = [min(roll_x_y_sided_dice(2,int(roll[1]))) for _ in range(int(roll[0]))]
+            result = [min(roll_x_y_sided_dice(2,int(roll[1]),py_rng)) for _ in range(int(roll[0]))]
         else:
             # take x, y-sided dice
-            result = roll_x_y_sided_dice(int(roll[0]), int(roll[1]))
+            result = roll_x_y_sided_dice(int(roll[0]), int(roll[1]), py_rng)
         
         # total them up, add to the running total and the results
         s = sum(result)
@@ -76,6 +710,406 @@ def do_rolls(rolls):
     # return the generated rolls
     return results, total
 
+def summarize_rolls(rolls, engine='python', rng=None):
+    """does rolls as do_rolls does, but streams the dice of each roll into a
+    Summary instead of keeping them, so that it takes the same memory however
+    many dice are rolled
+
+    Parameters:
+        rolls (list): the list of rolls to do, tuples or expressions
+        engine (str): 'python', or 'numpy' to roll in numpy arrays
+        rng: the generator to roll with, from make_rng, or None for a fresh
+            or global one
+
+    Returns:
+        results (list): a list of 2 tuples containing the Summary of the dice
+            kept and the total
+        total (int): the total for all the rolls
+    """
+    results = []
+    total = 0
+    if rng is None:
+        rng = make_rng(engine)
+    py_rng = rng if engine == 'python' else None
+    for roll in rolls:
+        if not isinstance(roll, Expression):
+            roll = compile_expression(f'{roll[0]}d{roll[1]}{roll[2] or ""}')
+        summary = Summary(roll.sides)
+        if engine == 'numpy' and roll.terms is not None and all(
+                term[1] < NUMPY_MAX_SIDES for _, term in roll.terms):
+            # roll a chunk of each term at a time
+            s = roll.constant
+            for sign, (x, y, keep) in roll.terms:
+                for start in range(0, x, CHUNK_SIZE):
+                    s += sign * summary.add_array(
+                            roll_x_y_sided_dice_numpy(min(CHUNK_SIZE, x - start), y, keep, rng))
+        else:
+            if py_rng is None:
+                # draw a python generator from numpy's, so seeds still hold
+                py_rng = random.Random(int(rng.integers(1 << 63)))
+            s = roll.summarize(summary, py_rng)
+        total += s
+        results.append((summary,s))
+    return results, total
+
+def _print_summary(summary):
+    """prints the statistics and histogram of a Summary"""
+    print(f"dice    : {summary.count}")
+    if not summary.count:
+        return
+    print(f"mean    : {summary.mean:.4f}")
+    print(f"variance: {summary.variance:.4f}")
+    print(f"std dev : {summary.variance ** 0.5:.4f}")
+    print(f"range   : {summary.min} to {summary.max}")
+    most = max(summary.hist)
+    for i, n in enumerate(summary.hist):
+        low, high = i * summary.width + 1, (i + 1) * summary.width
+        faces = str(low) if low == high else f'{low}-{high}'
+        print(f"{faces:>11} {n:>10} {'#' * round(40 * n / most)}".rstrip())
+
+def answer(line, engine='python', rng=None, summary=False):
+    """rolls one roll for --batch or --serve
+
+    Parameters:
+        line (str): the roll, as it would be passed on the command line
+        engine (str): 'python', or 'numpy' to roll in numpy arrays
+        rng: the generator to roll with, from make_rng
+        summary (bool): answer with a summary of the dice, not the dice
+
+    Returns:
+        reply (dict): the roll, its total, and its dice or their summary, or
+        else the roll and what was wrong with it
+    """
+    source = line.strip()
+    try:
+        roll = compile_expression(source)
+        if summary:
+            (res, total), = summarize_rolls([roll], engine, rng)[0]
+            return {'roll': source, 'total': total, 'summary': {
+                'count': res.count, 'mean': res.mean, 'variance': res.variance,
+                'min': res.min, 'max': res.max, 'width': res.width, 'hist': res.hist,
+            }}
+        (res, total), = do_rolls([roll], engine, rng)[0]
+    except ValueError as e:
+        return {'roll': source, 'error': str(e)}
+    except ZeroDivisionError:
+        return {'roll': source, 'error': "division by zero"}
+    return {'roll': source, 'total': total,
+            'dice': [dice if isinstance(dice, list) else dice.tolist() for dice in res]}
+
+def batch(lines, out, engine='python', rng=None, summary=False):
+    """answers each non-blank line with a line of json
+
+    Parameters:
+        lines (iterable): the rolls, one per line
+        out (file): where to write the answers
+        engine, rng, summary: as for answer
+    """
+    if rng is None:
+        rng = make_rng(engine)
+    for line in lines:
+        if line.strip():
+            out.write(json.dumps(answer(line, engine, rng, summary)) + '\n')
+            out.flush()
+
+def serve(address, engine='python', rng=None, summary=False, max_dice=SERVE_MAX_DICE):
+    """answers rolls sent a line at a time, as batch does, until interrupted
+
+    Parameters:
+        address (str): the path of a unix socket to listen on, or a
+            [host:]port, the host being localhost by default
+        engine, rng, summary: as for answer
+        max_dice (int): refuse rolls of more dice than this, None to roll any
+    """
+    import socketserver
+    import stat
+    import threading
+
+    if rng is None:
+        rng = make_rng(engine)
+    # the generators aren't safe to share between threads
+    lock = threading.Lock()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                source = line.decode('utf-8', 'replace').strip()
+                try:
+                    count = compile_expression(source).max_dice
+                except ValueError:
+                    # answer says what is wrong with it
+                    count = 0
+                if max_dice is not None and count > max_dice:
+                    reply = {'roll': source, 'error': f"too many dice, the most is {max_dice}"}
+                else:
+                    with lock:
+                        reply = answer(source, engine, rng, summary)
+                self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+    unix = os.sep in address or address.endswith('.sock')
+    if unix:
+        # clear away the socket of a server that didn't shut down
+        if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+            os.unlink(address)
+        server = socketserver.ThreadingUnixStreamServer(address, Handler)
+    else:
+        host, _, port = address.rpartition(':')
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        server = socketserver.ThreadingTCPServer((host or 'localhost', int(port)), Handler)
+    server.daemon_threads = True
+    print(f'serving on {address}...', flush=True)
+    try:
+        with server:
+            server.serve_forever()
+    finally:
+        if unix:
+            os.unlink(address)
+
+def make_rng(engine='python', seed=None):
+    """makes a random number generator for an engine
+
+    Parameters:
+        engine (str): 'python' or 'numpy'
+        seed: an int, or a list of ints, to seed the generator with. Without
+            one python rolls with the global generator and numpy with a
+            freshly seeded one.
+
+    Returns:
+        rng: a random.Random, or a np.random.Generator
+    """
+    if engine == 'numpy':
+        import numpy as np
+        return np.random.default_rng(seed)
+    if seed is None:
+        return random
+    # random.Random only takes scalar seeds
+    return random.Random(seed if isinstance(seed, int) else ':'.join(map(str, seed)))
+
+def _simulate_block(rolls, engine, seed, block, trials):
+    """rolls one block of trials, with the block's own random stream
+
+    Parameters:
+        rolls (list): the list of rolls to do in each trial
+        engine (str): 'python' or 'numpy', which only rolls expressions that
+            add and subtract plain, advantage and disadvantage dice
+        seed (int): the seed of the whole simulation
+        block (int): the number of the block, which picks its stream
+        trials (int): the number of trials in the block
+
+    Returns:
+        counts (Counter): the number of trials that came to each grand total
+    """
+    linear = _linear(rolls) if engine == 'numpy' else None
+    if linear is None or any(term[1] >= NUMPY_MAX_SIDES for _, term in linear[0]):
+        rng = make_rng('python', [seed, block])
+        return Counter(do_rolls(rolls, 'python', rng)[1] for _ in range(trials))
+
+    # roll every trial at once, a few dice of a term at a time
+    import numpy as np
+    rng = make_rng(engine, [seed, block])
+    terms, constant = linear
+    totals = np.full(trials, constant, dtype='i8')
+    for sign, (x, y, keep) in terms:
+        step = max(1, CHUNK_SIZE // trials)
+        for start in range(0, x, step):
+            n = min(step, x - start)
+            dice = roll_x_y_sided_dice_numpy(trials * n, y, keep, rng)
+            totals += sign * dice.reshape(trials, n).sum(axis=1, dtype='i8')
+    values, counts = np.unique(totals, return_counts=True)
+    return Counter(dict(zip(values.tolist(), counts.tolist())))
+
+def simulate(rolls, trials, seed, jobs=1, engine='python'):
+    """rolls a list of rolls many times over, and counts how often each grand
+    total comes up, without keeping the rolls
+
+    The trials are split into blocks of TRIAL_BLOCK, and each block gets a
+    random stream seeded by the seed and the number of the block, so the
+    counts are the same for a seed however many processes roll them.
+
+    Parameters:
+        rolls (list): the list of rolls to do in each trial
+        trials (int): the number of trials
+        seed (int): the seed to roll with
+        jobs (int): the number of processes to roll with, 0 for one per cpu
+        engine (str): 'python' or 'numpy'
+
+    Returns:
+        counts (Counter): the number of trials that came to each grand total
+    """
+    blocks = [(block, min(TRIAL_BLOCK, trials - start))
+            for block, start in enumerate(range(0, trials, TRIAL_BLOCK))]
+    work = functools.partial(_simulate_block, rolls, engine, seed)
+    counts = Counter()
+    if jobs == 1 or len(blocks) < 2:
+        for block in blocks:
+            counts.update(work(*block))
+        return counts
+    import multiprocessing as mp
+    with mp.Pool(jobs or None) as pool:
+        for part in pool.starmap(work, blocks):
+            counts.update(part)
+    return counts
+
+def counts_stats(counts, percentiles=PERCENTILES):
+    """summarizes how often each total came up, as dist_stats summarizes a
+    distribution
+
+    Parameters:
+        counts (Counter): the number of times each total came up
+        percentiles (list): the percentiles to find
+
+    Returns:
+        stats (dict): the mean, variance, standard deviation, smallest and
+        largest totals, and the total at each percentile
+    """
+    n = sum(counts.values())
+    totals = sorted(counts)
+    mean = sum(total * count for total, count in counts.items()) / n
+    variance = sum(count * (total - mean) ** 2 for total, count in counts.items()) / n
+    stats = {
+        'mean': mean,
+        'variance': variance,
+        'stdev': variance ** 0.5,
+        'min': totals[0],
+        'max': totals[-1],
+        'percentiles': dict(),
+    }
+    # walk up the totals, noting where each percentile is passed
+    seen = 0
+    wanted = iter(sorted(percentiles))
+    q = next(wanted, None)
+    for total in totals:
+        seen += counts[total]
+        while q is not None and seen * 100 >= q * n:
+            stats['percentiles'][q] = total
+            q = next(wanted, None)
+    return stats
+
+def _print_stats(stats):
+    """prints the summary from dist_stats or counts_stats"""
+    print(f"mean    : {stats['mean']:.4f}")
+    print(f"variance: {stats['variance']:.4f}")
+    print(f"std dev : {stats['stdev']:.4f}")
+    print(f"range   : {stats['min']} to {stats['max']}")
+    print('percentiles: ' + ', '.join(f'{q}%: {total}' for q, total in stats['percentiles'].items()))
+
+def die_pmf(y, keep=None):
+    """computes the distribution of one roll of a y-sided die, or of the
+    greater or lesser of two for advantage or disadvantage
+
+    Parameters:
+        y (int): the number of sides on the die
+        keep (str): None, 'a' for advantage, or 'd' for disadvantage
+
+    Returns:
+        pmf (np.ndarray): the chance of rolling 1 through y
+    """
+    import numpy as np
+    k = np.arange(1, y + 1, dtype=float)
+    if keep == 'a':
+        # P(max <= k) = (k/y)^2, so P(max = k) = (2k - 1) / y^2
+        return (2 * k - 1) / (y * y)
+    if keep == 'd':
+        # P(min >= k) = ((y - k + 1)/y)^2, so P(min = k) = (2(y - k) + 1) / y^2
+        return (2 * (y - k) + 1) / (y * y)
+    return np.full(y, 1 / y)
+
+def _convolve(a, b):
+    """convolves two distributions, by fft when they are long"""
+    import numpy as np
+    if min(len(a), len(b)) < FFT_THRESHOLD:
+        return np.convolve(a, b)
+    n = len(a) + len(b) - 1
+    pmf = np.fft.irfft(np.fft.rfft(a, n) * np.fft.rfft(b, n), n)
+    # fft leaves rounding noise around zero, which is no chance at all
+    np.clip(pmf, 0, None, out=pmf)
+    return pmf / pmf.sum()
+
+def roll_pmf(x, y, keep=None):
+    """computes the distribution of the total of x, y-sided dice by
+    convolving the distribution of one die with itself, squaring as it goes
+    so that it takes log(x) convolutions
+
+    Parameters:
+        x (int): the number of dice to roll
+        y (int): the number of sides on each die
+        keep (str): None, 'a' for advantage, or 'd' for disadvantage
+
+    Returns:
+        pmf (np.ndarray): the chance of each total, starting from offset
+        offset (int): the smallest total, x
+    """
+    import numpy as np
+    pmf = np.ones(1)
+    base = die_pmf(y, keep)
+    n = x
+    while n:
+        if n & 1:
+            pmf = _convolve(pmf, base)
+        n >>= 1
+        if n:
+            base = _convolve(base, base)
+    return pmf, x
+
+def dist(rolls):
+    """computes the exact distribution of the grand total of a list of rolls,
+    in the form do_rolls takes
+
+    Parameters:
+        rolls (list): the list of rolls to do
+
+    Returns:
+        pmf (np.ndarray): the chance of each grand total, starting from offset
+        offset (int): the smallest grand total
+
+    Raises:
+        ValueError: if a roll does more than add and subtract plain,
+            advantage and disadvantage dice and numbers
+    """
+    import numpy as np
+    linear = _linear(rolls)
+    if linear is None:
+        raise ValueError("only sums of plain, advantage and disadvantage dice have an exact distribution")
+    terms, offset = linear
+    pmf = np.ones(1)
+    for sign, (x, y, keep) in terms:
+        term, low = roll_pmf(x, y, keep)
+        if sign < 0:
+            # subtracting a term flips its distribution around zero
+            term, low = term[::-1], -(low + len(term) - 1)
+        pmf, offset = _convolve(pmf, term), offset + low
+    return pmf, offset
+
+def dist_stats(pmf, offset, percentiles=PERCENTILES):
+    """summarizes a distribution of totals
+
+    Parameters:
+        pmf (np.ndarray): the chance of each total, starting from offset
+        offset (int): the smallest total
+        percentiles (list): the percentiles to find
+
+    Returns:
+        stats (dict): the mean, variance, standard deviation, smallest and
+        largest totals, and the total at each percentile
+    """
+    import numpy as np
+    totals = np.arange(offset, offset + len(pmf), dtype=float)
+    mean = float(pmf @ totals)
+    variance = float(pmf @ (totals - mean) ** 2)
+    cdf = np.cumsum(pmf)
+    return {
+        'mean': mean,
+        'variance': variance,
+        'stdev': variance ** 0.5,
+        'min': offset,
+        'max': offset + len(pmf) - 1,
+        # the smallest total that at least q% of rolls come to or under
+        'percentiles': {q: offset + min(int(np.searchsorted(cdf, q / 100 - 1e-12)), len(pmf) - 1)
+                for q in percentiles},
+    }
+
 # if this is the main method
 if __name__ == "__main__":
 
@@ -84,32 +1118,120 @@ if __name__ == "__main__":
         print(help_str)
         sys.exit(0)
 
-    # compile a pattern to match the die roll args
-    pattern = re.compile(r'^([1-9][0-9]*)d([1-9][0-9]*)(a|d)?$')
+    parser = ap.ArgumentParser('roll', description=help_str, formatter_class=ap.RawDescriptionHelpFormatter)
+    parser.add_argument('rolls', action='store', nargs='*', metavar='roll',
+            type=str, help="a roll of the form <number>d<number>, optionally followed by a or d, or a dice expression")
+    parser.add_argument('-e', '--engine', action='store', dest='engine', default='python',
+            choices=ENGINES, help="how to roll: in python, or in numpy arrays for huge rolls")
+    parser.add_argument('--dist', action='store_true', dest='dist',
+            help="print the exact distribution of the total instead of rolling")
+    parser.add_argument('--table', action='store_true', dest='table',
+            help="with --dist or --trials, list the chance of rolling each total")
+    parser.add_argument('-n', '--trials', action='store', dest='trials', default=None,
+            type=int, help="roll everything this many times and print the statistics of the totals")
+    parser.add_argument('-s', '--seed', action='store', dest='seed', default=None,
+            type=int, help="the seed to roll with, to get the same rolls every time")
+    parser.add_argument('-j', '--jobs', action='store', dest='jobs', default=1,
+            type=int, help="with --trials, the number of processes to roll with, 0 for one per cpu")
+    parser.add_argument('--summary', action='store_true', dest='summary',
+            help="print statistics of the dice rather than every die, for huge rolls")
+    parser.add_argument('--batch', action='store_true', dest='batch',
+            help="roll each line of stdin, answering each with a line of json")
+    parser.add_argument('--serve', action='store', dest='serve', default=None, metavar='ADDRESS',
+            type=str, help="answer rolls as --batch does over a unix socket, or a [host:]port")
+    parser.add_argument('--max-dice', action='store', dest='max_dice', default=SERVE_MAX_DICE,
+            type=int, help="with --serve, refuse rolls of more dice than this, 0 for no limit")
+    args = parser.parse_args()
+    if args.trials is not None and args.trials < 1:
+        parser.error("argument -n/--trials: must be at least 1")
 
-    # a list of compiled matches
+    # keep rolling what comes in
+    if args.batch or args.serve:
+        rng = make_rng(args.engine, args.seed)
+        try:
+            if args.batch:
+                batch(sys.stdin, sys.stdout, args.engine, rng, args.summary)
+            else:
+                serve(args.serve, args.engine, rng, args.summary, args.max_dice or None)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    if not args.rolls:
+        parser.error("the following arguments are required: roll")
+
+    # a list of compiled expressions
     matches = []
 
-    # match each roll and get the groups
-    for arg in sys.argv[1:]:
-        match = pattern.match(arg)
-        # bad arg, complain
-        if not match:
-            print(f"Bad argument: {arg}")
+    # compile each roll
+    for arg in args.rolls:
+        try:
+            matches.append(compile_expression(arg))
+        except ValueError as e:
+            # bad arg, complain
+            print(f"Bad argument: {arg} ({e})")
             print(help_str)
             sys.exit(1)
-        matches.append(match.groups())
+
+    # work out the odds rather than rolling
+    if args.dist:
+        try:
+            pmf, offset = dist(matches)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        print(' + '.join(args.rolls))
+        _print_stats(dist_stats(pmf, offset))
+        if args.table:
+            print()
+            print(f"{'total':>7} {'chance':>10} {'at most':>10}")
+            at_most = 0
+            for total, chance in enumerate(pmf, offset):
+                at_most += chance
+                print(f"{total:>7} {chance:>10.6f} {at_most:>10.6f}")
+        sys.exit(0)
+
+    # roll it all over and over
+    if args.trials:
+        # pick a seed to report, so the run can be repeated
+        seed = random.SystemRandom().getrandbits(63) if args.seed is None else args.seed
+        try:
+            counts = simulate(matches, args.trials, seed, args.jobs, args.engine)
+        except ZeroDivisionError:
+            print(f"Bad argument: {' '.join(args.rolls)} (division by zero)")
+            sys.exit(1)
+        print(' + '.join(args.rolls))
+        print(f"trials  : {args.trials}, seed {seed}")
+        _print_stats(counts_stats(counts))
+        if args.table:
+            print()
+            print(f"{'total':>7} {'trials':>10} {'chance':>10}")
+            for total in sorted(counts):
+                print(f"{total:>7} {counts[total]:>10} {counts[total] / args.trials:>10.6f}")
+        sys.exit(0)
 
     # do the hard work
-    results, grand_total = do_rolls(matches)
+    rng = None if args.seed is None else make_rng(args.engine, args.seed)
+    try:
+        if args.summary:
+            results, grand_total = summarize_rolls(matches, args.engine, rng)
+        else:
+            results, grand_total = do_rolls(matches, args.engine, rng)
+    except ZeroDivisionError:
+        # a divisor that was rolled can still come up 0
+        print(f"Bad argument: {' '.join(args.rolls)} (division by zero)")
+        sys.exit(1)
 
     # print results
-    for roll, (res, total) in zip(sys.argv[1:], results):
+    for roll, (res, total) in zip(args.rolls, results):
         print(f"{roll:<7}: {total}")
-        print(res)
-        if len(sys.argv) > 2:
+        if args.summary:
+            _print_summary(res)
+        else:
+            # numpy arrays print differently, and cut big rolls short
+            print(' '.join(str(dice if isinstance(dice, list) else dice.tolist()) for dice in res))
+        if len(args.rolls) > 1:
             print()
     
     # print grand total
-    if len(sys.argv) > 2:
+    if len(args.rolls) > 1:
         print(f"Total: {grand_total}")